@@ -0,0 +1,234 @@
+"""
+Script to build the tokenized training bitext from Solr XML files, incrementally.
+
+Every XML file is converted (see convert_solr_xml_to_bitext.py) and tokenized
+(see tokenize_jbo.py) into a shard of three line-aligned files, cached under
+a key computed from the content of the XML file, the source code of this
+script and of the conversion and tokenization scripts (and of the modules of
+the web server they use) and the English tokenizer command. Only
+the files whose key is not in the cache are processed (in parallel with -j),
+and the corpus is assembled by concatenating the shards in the order of the
+files on the command line:
+
+    PREFIX          bitext (tab-separated Lojban and English)
+    PREFIX.tok.jb   tokenized Lojban side
+    PREFIX.tok.en   English side, piped through --en-tokenizer if given
+
+The output is the same as that of the pipeline
+
+    python convert_solr_xml_to_bitext.py XML_FILE... > PREFIX
+    cut -f 1 PREFIX | python tokenize_jbo.py > PREFIX.tok.jb
+    cut -f 2 PREFIX | EN_TOKENIZER > PREFIX.tok.en
+
+With --clean, the pairs that clean_bitext.py would remove from the bitext are
+left out of all three files, which stay line-aligned.
+
+Usage:
+
+    python build_corpus.py [-j PROCESSES] [--cache-dir DIR] [--en-tokenizer COMMAND] [--clean]
+        PREFIX XML_FILE...
+
+    e.g. python scripts/build_corpus.py -j 4 \\
+             --en-tokenizer 'mosesdecoder/scripts/tokenizer/tokenizer.perl -l en' \\
+             corpus/train docs/*.xml
+"""
+import argparse
+import hashlib
+import itertools
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import clean_bitext
+import convert_solr_xml_to_bitext
+import tokenize_jbo
+
+# Default directory of the cached shards. It is outside corpus/, which
+# train.sh removes before every build.
+CACHE_DIR = 'corpus.cache'
+
+# Output files of a shard or of the corpus, as suffixes of their prefix.
+SUFFIXES = ['', '.tok.jb', '.tok.en']
+
+
+def _file_digest(path, digest=None):
+    """Update digest (default: a new SHA-1) with the content of the file at path, and return it."""
+    if digest is None:
+        digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest
+
+
+def pipeline_key(en_tokenizer=None):
+    """Fingerprint the conversion and tokenization code and options.
+
+    Any change to them invalidates every cached shard.
+    """
+    digest = hashlib.sha1()
+    for module in [sys.modules[__name__], convert_solr_xml_to_bitext,
+                   convert_solr_xml_to_bitext.translation_memory, tokenize_jbo,
+                   tokenize_jbo.tokenize_jb]:
+        _file_digest(os.path.splitext(module.__file__)[0] + '.py', digest)
+    digest.update(repr(en_tokenizer))
+    return digest.hexdigest()
+
+
+def shard_prefix(cache_dir, xml_file, pipeline):
+    """Return the path prefix of the cached shard of xml_file for the given pipeline key."""
+    digest = _file_digest(xml_file)
+    digest.update(pipeline)
+    name = os.path.splitext(os.path.basename(xml_file))[0]
+    return os.path.join(cache_dir, '%s.%s' % (name, digest.hexdigest()))
+
+
+def is_cached(prefix):
+    """Return whether all the files of the shard at prefix are in the cache."""
+    return all(os.path.exists(prefix + suffix) for suffix in SUFFIXES)
+
+
+def _build_shard_files(xml_file, tmp, en_tokenizer):
+    """Write the shard of xml_file at the prefix tmp, see build_shard()."""
+    with open(tmp, 'wb') as f:
+        convert_solr_xml_to_bitext.write_bitext(
+            convert_solr_xml_to_bitext.iterparse_bitext(xml_file), f)
+    # Same as cut -f 1 / cut -f 2: lines without a tab are taken whole.
+    with open(tmp, 'rb') as f_bitext, \
+            open(tmp + '.tok.jb', 'wb') as f_jb, open(tmp + '.en', 'wb') as f_en:
+        for line in f_bitext:
+            fields = line.rstrip('\n').split('\t')
+            f_jb.write(' '.join(tokenize_jbo.tokenize(fields[0].rstrip())) + '\n')
+            f_en.write((fields[1] if len(fields) > 1 else fields[0]) + '\n')
+    if en_tokenizer:
+        with open(tmp + '.en', 'rb') as f_in, open(tmp + '.tok.en', 'wb') as f_out:
+            subprocess.check_call(en_tokenizer, shell=True, stdin=f_in, stdout=f_out)
+        os.remove(tmp + '.en')
+    else:
+        os.rename(tmp + '.en', tmp + '.tok.en')
+
+
+def build_shard(args):
+    """Convert and tokenize one XML file into the shard at prefix.
+
+    The files are written under temporary names and renamed into place,
+    so an interrupted build never leaves a partial shard in the cache.
+    """
+    xml_file, prefix, en_tokenizer = args
+    tmp = '%s.tmp%d' % (prefix, os.getpid())
+    try:
+        _build_shard_files(xml_file, tmp, en_tokenizer)
+    except:
+        for path in [tmp + suffix for suffix in SUFFIXES + ['.en']]:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    for suffix in SUFFIXES:
+        os.rename(tmp + suffix, prefix + suffix)
+    return xml_file
+
+
+def assemble(output_prefix, prefixes, cleaner=None):
+    """Concatenate the shards at prefixes into the corpus files at output_prefix.
+
+    Args:
+        cleaner: clean_bitext.BitextCleaner deciding, from the bitext line,
+            whether each line of the shards is kept, or None to keep all lines.
+    """
+    if cleaner is None:
+        for suffix in SUFFIXES:
+            with open(output_prefix + suffix, 'wb') as f_out:
+                for prefix in prefixes:
+                    with open(prefix + suffix, 'rb') as f_in:
+                        shutil.copyfileobj(f_in, f_out)
+        return
+    outputs = [open(output_prefix + suffix, 'wb') for suffix in SUFFIXES]
+    try:
+        for prefix in prefixes:
+            inputs = [open(prefix + suffix, 'rb') for suffix in SUFFIXES]
+            try:
+                for lines in itertools.izip(*inputs):
+                    if cleaner.check(lines[0]) is None:
+                        for f_out, line in zip(outputs, lines):
+                            f_out.write(line)
+            finally:
+                for f_in in inputs:
+                    f_in.close()
+    finally:
+        for f_out in outputs:
+            f_out.close()
+
+
+def build_corpus(output_prefix, xml_files, cache_dir=CACHE_DIR, en_tokenizer=None, processes=1,
+                 cleaner=None):
+    """Build the corpus files at output_prefix from xml_files, reusing the cached shards.
+
+    Args:
+        output_prefix: path prefix of the corpus files, see SUFFIXES.
+        xml_files: list of Solr XML filenames.
+        cache_dir: directory of the cached shards.
+        en_tokenizer: shell command tokenizing English lines from STDIN to STDOUT, or None.
+        processes: number of shards built in parallel (None: the number of CPUs).
+        cleaner: clean_bitext.BitextCleaner filtering the pairs of the corpus, or None.
+
+    Returns:
+        the number of shards (re)built.
+    """
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    pipeline = pipeline_key(en_tokenizer)
+    prefixes = [shard_prefix(cache_dir, xml_file, pipeline) for xml_file in xml_files]
+    missing = [(xml_file, prefix, en_tokenizer)
+               for xml_file, prefix in zip(xml_files, prefixes) if not is_cached(prefix)]
+    # A file given twice is built once.
+    missing = dict((task[1], task) for task in missing).values()
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if processes <= 1 or len(missing) <= 1:
+        for task in missing:
+            build_shard(task)
+    else:
+        pool = multiprocessing.Pool(min(processes, len(missing)))
+        try:
+            for _ in pool.imap_unordered(build_shard, missing):
+                pass
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    assemble(output_prefix, prefixes, cleaner)
+    return len(missing)
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(
+        description='Build the tokenized bitext from Solr XML files, reusing cached shards.')
+    parser.add_argument('output_prefix', help='prefix of the corpus files (e.g. corpus/train)')
+    parser.add_argument('xml_files', nargs='+', help='Solr XML files with jbo_t and eng_t fields')
+    parser.add_argument('-j', '--processes', type=int, default=1,
+                        help='number of files processed in parallel (default: 1)')
+    parser.add_argument('--cache-dir', default=CACHE_DIR,
+                        help='directory of the cached shards (default: %s)' % CACHE_DIR)
+    parser.add_argument('--en-tokenizer',
+                        help='shell command tokenizing the English side (default: none)')
+    parser.add_argument('--clean', action='store_true',
+                        help='remove duplicates and length outliers with the defaults of clean_bitext.py')
+    args = parser.parse_args()
+    cleaner = clean_bitext.BitextCleaner() if args.clean else None
+    t = time.time()
+    n = build_corpus(args.output_prefix, args.xml_files, args.cache_dir, args.en_tokenizer,
+                     args.processes, cleaner)
+    print >>sys.stderr, '%d of %d files (re)built in %.1fs' % (n, len(args.xml_files),
+                                                               time.time() - t)
+    if cleaner is not None:
+        print >>sys.stderr, cleaner.report()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+Script to clean a bitext (tab-separated Lojban and English, as written by
+convert_solr_xml_to_bitext.py) in a single streaming pass.
+
+A pair is removed if
+    - it does not have exactly two non-empty fields (malformed),
+    - either side has fewer than --min-len or more than --max-len words (length),
+    - one side has more than --max-ratio times as many words as the other (ratio),
+    - the same pair was seen before (duplicate),
+    - the same pair was seen before up to case, punctuation and spacing (near-duplicate).
+
+Only a 64-bit digest of every kept pair and of its normalized form is
+remembered, not the pairs themselves. The number of pairs removed for each
+reason is reported on STDERR.
+
+Usage:
+
+    python clean_bitext.py [--min-len N] [--max-len N] [--max-ratio R] [--no-near-dup] \\
+        < BITEXT > CLEAN_BITEXT
+"""
+import argparse
+import collections
+import hashlib
+import re
+import sys
+
+# Defaults of the length and ratio filters, the same as those of Moses's
+# clean-corpus-n.perl in train.sh.
+MIN_LEN = 1
+MAX_LEN = 80
+MAX_RATIO = 9.0
+
+# Removal reasons, in the order they are checked.
+MALFORMED = 'malformed'
+LENGTH = 'length'
+RATIO = 'ratio'
+DUPLICATE = 'duplicate'
+NEAR_DUPLICATE = 'near-duplicate'
+REASONS = [MALFORMED, LENGTH, RATIO, DUPLICATE, NEAR_DUPLICATE]
+
+# Everything but letters, digits, apostrophes (which are letters in Lojban) and spaces.
+_PUNCTUATION = re.compile(r"[^\w' ]+", re.UNICODE)
+
+
+def _digest(text):
+    return hashlib.md5(text).digest()[:8]
+
+
+def normalize(text):
+    """Return the near-duplicate key of a text: lowercased, without punctuation and extra spaces."""
+    return ' '.join(_PUNCTUATION.sub(' ', text.lower()).split())
+
+
+class BitextCleaner(object):
+    """Streaming filter of bitext pairs, see the module docstring."""
+
+    def __init__(self, min_len=MIN_LEN, max_len=MAX_LEN, max_ratio=MAX_RATIO, near_dup=True):
+        self.min_len = min_len
+        self.max_len = max_len
+        self.max_ratio = max_ratio
+        self.near_dup = near_dup
+        self.seen = set()
+        self.seen_normalized = set()
+        self.kept = 0
+        self.removed = collections.Counter()
+
+    def check(self, line):
+        """Check a bitext line (UTF-8 bytes, with or without the newline).
+
+        Returns:
+            None if the pair is kept, else the reason (one of REASONS) why it is removed.
+        """
+        reason = self._check(line.rstrip('\n'))
+        if reason is None:
+            self.kept += 1
+        else:
+            self.removed[reason] += 1
+        return reason
+
+    def _check(self, line):
+        fields = line.split('\t')
+        if len(fields) != 2 or not fields[0].strip() or not fields[1].strip():
+            return MALFORMED
+        len_jb, len_en = len(fields[0].split()), len(fields[1].split())
+        if not (self.min_len <= len_jb <= self.max_len and self.min_len <= len_en <= self.max_len):
+            return LENGTH
+        if max(len_jb, len_en) > self.max_ratio * min(len_jb, len_en):
+            return RATIO
+        key = _digest(line)
+        if key in self.seen:
+            return DUPLICATE
+        if self.near_dup:
+            jbo_t, eng_t = line.decode('utf-8').split('\t')
+            normalized_key = _digest((u'%s\t%s' % (normalize(jbo_t), normalize(eng_t))).encode('utf-8'))
+            if normalized_key in self.seen_normalized:
+                return NEAR_DUPLICATE
+            self.seen_normalized.add(normalized_key)
+        self.seen.add(key)
+        return None
+
+    def report(self):
+        """Return a one-line summary of the pairs kept and removed."""
+        total = self.kept + sum(self.removed.values())
+        return '%d of %d pairs kept; removed: %s' % (
+            self.kept, total, ', '.join('%d %s' % (self.removed[reason], reason)
+                                        for reason in REASONS))
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description='Clean a Lojban-English bitext from STDIN to STDOUT.')
+    parser.add_argument('--min-len', type=int, default=MIN_LEN,
+                        help='minimum number of words of each side (default: %d)' % MIN_LEN)
+    parser.add_argument('--max-len', type=int, default=MAX_LEN,
+                        help='maximum number of words of each side (default: %d)' % MAX_LEN)
+    parser.add_argument('--max-ratio', type=float, default=MAX_RATIO,
+                        help='maximum ratio of the numbers of words of the sides (default: %g)'
+                        % MAX_RATIO)
+    parser.add_argument('--no-near-dup', dest='near_dup', action='store_false',
+                        help='only remove exact duplicates')
+    args = parser.parse_args()
+
+    cleaner = BitextCleaner(args.min_len, args.max_len, args.max_ratio, args.near_dup)
+    for line in sys.stdin:
+        if cleaner.check(line) is None:
+            sys.stdout.write(line)
+    print >>sys.stderr, cleaner.report()
+
+
+if __name__ == '__main__':
+    main()
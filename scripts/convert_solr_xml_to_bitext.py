@@ -1,9 +1,25 @@
 """
 Script to convert to a Apache Solr readable XML format
 to bitext (tab-separated plain text) of Lojban and English.
+
+The XML files are parsed incrementally, so memory use does not grow with
+their size. With -j, the files are converted in parallel, and the bitext is
+written in the order of the files on the command line.
+
+Usage:
+
+    python convert_solr_xml_to_bitext.py [-j PROCESSES] XML_FILE... > BITEXT_FILE
 """
+import argparse
+import multiprocessing
+import os
+import shutil
 import sys
-import xml.etree.ElementTree as ET
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'web', 'web'))
+
+import translation_memory
 
 
 def iterate_bitext(add_root_node):
@@ -19,33 +35,98 @@ def iterate_bitext(add_root_node):
     Skip the document if either field is missing or empty.
     """
     for doc_node in add_root_node:
-        jbo_t = None
-        eng_t = None
-        for field_node in doc_node:
-            if field_node.attrib['name'] == 'jbo_t':
-                jbo_t = field_node.text
-            if field_node.attrib['name'] == 'eng_t':
-                eng_t = field_node.text
-        if not (jbo_t and eng_t):
-            continue
-        yield (jbo_t, eng_t)
+        pair = _doc_bitext(doc_node)
+        if pair is not None:
+            yield pair
 
 
-def main():
-    """Main function"""
-    if len(sys.argv) == 1:
-        print "Usage: python convert_solr_xml_to_bitext.py [XML filename] > output text filename"
-        sys.exit(1)
+def _doc_bitext(doc_node):
+    """Return the tuple (jbo_t, eng_t) of a 'doc' node, or None if either field is missing or empty."""
+    jbo_t = None
+    eng_t = None
+    for field_node in doc_node:
+        if field_node.attrib['name'] == 'jbo_t':
+            jbo_t = field_node.text
+        if field_node.attrib['name'] == 'eng_t':
+            eng_t = field_node.text
+    if not (jbo_t and eng_t):
+        return None
+    return (jbo_t, eng_t)
 
-    for filename in sys.argv[1:]:
-        tree = ET.parse(filename)
-        root = tree.getroot()
 
-        for jbo_t, eng_t in iterate_bitext(root):
-            print '%s\t%s' % (jbo_t, eng_t)
+def iterparse_bitext(source):
+    """Yield the bitext of a Solr XML file without building its whole tree.
+
+    The file is parsed incrementally with translation_memory.iterparse_docs()
+    of the web server, so memory use is bounded by the largest document, not
+    by the file size.
+
+    Args:
+        source: XML filename or file object.
+    Returns:
+        generator over tuples (jbo_t, eng_t), see iterate_bitext().
+    """
+    for doc_node in translation_memory.iterparse_docs(source):
+        pair = _doc_bitext(doc_node)
+        if pair is not None:
+            yield pair
+
+
+def write_bitext(pairs, f):
+    """Write (jbo_t, eng_t) tuples to the file object f as UTF-8 lines."""
+    for jbo_t, eng_t in pairs:
+        f.write((u'%s\t%s\n' % (jbo_t, eng_t)).encode('utf-8'))
+
+
+def _convert_to_temp_file(filename):
+    fd, path = tempfile.mkstemp(prefix='bitext.', suffix='.txt')
+    with os.fdopen(fd, 'wb') as f:
+        write_bitext(iterparse_bitext(filename), f)
+    return path
+
+
+def convert(filenames, output, processes=1):
+    """Convert Solr XML files to bitext, written to output in the order of filenames.
+
+    Args:
+        filenames: list of XML filenames.
+        output: file object to write the UTF-8 bitext to.
+        processes: number of files converted in parallel (None: the number of CPUs).
+            Each process writes the bitext of its file to a temporary file,
+            which is copied to output once the files before it are written.
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(filenames))
+    if processes <= 1:
+        for filename in filenames:
+            write_bitext(iterparse_bitext(filename), output)
+        return
+    pool = multiprocessing.Pool(processes)
+    paths = []
+    try:
+        for path in pool.imap(_convert_to_temp_file, filenames):
+            paths.append(path)
+            with open(path, 'rb') as f:
+                shutil.copyfileobj(f, output)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+        for path in paths:
+            os.remove(path)
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(
+        description='Convert Solr XML files to Lojban-English bitext, written to STDOUT.')
+    parser.add_argument('xml_files', nargs='+', help='Solr XML files with jbo_t and eng_t fields')
+    parser.add_argument('-j', '--processes', type=int, default=1,
+                        help='number of files converted in parallel (default: 1)')
+    args = parser.parse_args()
+    convert(args.xml_files, sys.stdout, args.processes)
 
 
 if __name__ == '__main__':
-    import codecs
-    sys.stdout = codecs.getwriter('utf_8')(sys.stdout)
     main()
@@ -4,33 +4,24 @@ rm -rf corpus
 
 mkdir corpus
 
-python scripts/convert_solr_xml_to_bitext.py docs/aspect.xml > corpus/train
-python scripts/convert_solr_xml_to_bitext.py docs/cll.xml >> corpus/train
-python scripts/convert_solr_xml_to_bitext.py docs/conlang.xml >> corpus/train
-python scripts/convert_solr_xml_to_bitext.py docs/jbowiki.xml >> corpus/train
-python scripts/convert_solr_xml_to_bitext.py docs/phrasebook.xml >> corpus/train
-python scripts/convert_solr_xml_to_bitext.py docs/tatoeba.xml >> corpus/train
-python scripts/convert_solr_xml_to_bitext.py docs/teris.xml >> corpus/train
-python scripts/convert_solr_xml_to_bitext.py docs/introduction.xml >> corpus/train
-python scripts/convert_solr_xml_to_bitext.py docs/crashcourse1.xml >> corpus/train
+# Convert, tokenize and clean the corpus, reusing the shards of unchanged files cached in corpus.cache/
 
-# Preprocess corpus
-
-cat corpus/train | cut -f 1 | python scripts/tokenize_jbo.py > corpus/train.tok.jb
-cat corpus/train | cut -f 2 > corpus/train.tok.en
+python scripts/build_corpus.py -j 4 --clean \
+    corpus/train docs/aspect.xml docs/cll.xml \
+    docs/conlang.xml docs/jbowiki.xml docs/phrasebook.xml docs/tatoeba.xml \
+    docs/teris.xml docs/introduction.xml docs/crashcourse1.xml
 
 mosesdecoder/scripts/training/clean-corpus-n.perl corpus/train.tok jb en corpus/train.clean 1 80
 
-# Create dev set
+# Create dev and test sets (odd and even lines of crashcourse4)
 
-python scripts/convert_solr_xml_to_bitext.py docs/crashcourse4.xml | python scripts/mod.py --mod 2 -n 1 > corpus/dev
+python scripts/convert_solr_xml_to_bitext.py docs/crashcourse4.xml | \
+    python scripts/split_corpus.py --parts test,dev -o 'corpus/{part}'
 
 cat corpus/dev | cut -f 1 | python scripts/tokenize_jbo.py > corpus/dev.tok.jb
 cat corpus/dev | cut -f 2 > corpus/dev.tok.en
 
-# Create test set
-
-python scripts/convert_solr_xml_to_bitext.py docs/crashcourse4.xml | python scripts/mod.py --mod 2 -n 0 > corpus/test
+# Tokenize test set
 
 cat corpus/test | cut -f 1 | python scripts/tokenize_jbo.py > corpus/test.tok.jb
 cat corpus/test | cut -f 2 > corpus/test.tok.en
@@ -0,0 +1,158 @@
+"""
+Script to split a corpus into several parts (e.g. train/dev/test) in a single pass.
+
+The input is one or more line-aligned files (e.g. a bitext, or the two sides
+of a tokenized corpus); line i of every input goes to the same part. Each
+part has a weight, and lines are assigned to parts in one of three modes:
+
+    modulo  line x (counted from --base) goes to the part covering x mod W,
+            where W is the sum of the (integer) weights and the parts cover
+            consecutive residues in the order they are given. With parts
+            test,dev this is what mod.py --mod 2 -n 0 and -n 1 used to extract.
+    hash    a line goes to the part its hash (of the first input, salted
+            with --seed) falls into, so the part of a line does not change
+            when other lines are added or removed.
+    ratio   each line goes to the part furthest below its share of the lines
+            so far, so every prefix of the input is split in the ratio of
+            the weights, whatever the weights.
+
+Usage:
+
+    python split_corpus.py [--mode MODE] --parts NAME[:WEIGHT],... -o TEMPLATE [-o TEMPLATE...] \\
+        [INPUT...]
+
+    where TEMPLATE is the output filename of the corresponding INPUT (default:
+    STDIN), with {part} replaced by the name of the part. E.g.
+
+    python split_corpus.py --parts test,dev -o 'corpus/{part}' < bitext
+    python split_corpus.py --mode hash --parts train:8,dev:1,test:1 \\
+        -o 'corpus/{part}.jb' -o 'corpus/{part}.en' corpus/all.jb corpus/all.en
+"""
+import argparse
+import hashlib
+import itertools
+import sys
+
+MODULO = 'modulo'
+HASH = 'hash'
+RATIO = 'ratio'
+MODES = [MODULO, HASH, RATIO]
+
+
+def parse_parts(spec):
+    """Parse 'NAME[:WEIGHT],...' to a list of (name, weight) tuples (default weight: 1)."""
+    parts = []
+    for item in spec.split(','):
+        name, _, weight = item.partition(':')
+        parts.append((name, float(weight) if weight else 1.0))
+    return parts
+
+
+def modulo_assigner(weights, base=0):
+    """Return a function mapping (line number, line) to a part index, see MODULO."""
+    if any(w != int(w) or w < 0 for w in weights):
+        raise ValueError('weights must be non-negative integers in %s mode' % MODULO)
+    residues = []
+    for i, w in enumerate(weights):
+        residues.extend([i] * int(w))
+    return lambda x, line: residues[(x + base) % len(residues)]
+
+
+def hash_assigner(weights, seed=''):
+    """Return a function mapping (line number, line) to a part index, see HASH."""
+    total = sum(weights)
+    # upper bounds of the 32-bit hash values of each part
+    bounds, acc = [], 0.0
+    for w in weights:
+        acc += w
+        bounds.append(int(acc / total * 2 ** 32))
+    bounds[-1] = 2 ** 32
+
+    def assign(x, line):
+        h = int(hashlib.md5(seed + line).hexdigest()[:8], 16)
+        for i, bound in enumerate(bounds):
+            if h < bound:
+                return i
+    return assign
+
+
+def ratio_assigner(weights):
+    """Return a function mapping (line number, line) to a part index, see RATIO."""
+    total = sum(weights)
+    shares = [float(w) / total for w in weights]
+    counts = [0] * len(weights)
+
+    def assign(x, line):
+        # the part with the largest deficit (x + 1) * share - count; the first one on ties
+        i = max(range(len(shares)), key=lambda j: ((x + 1) * shares[j] - counts[j], -j))
+        counts[i] += 1
+        return i
+    return assign
+
+
+def split(inputs, outputs, assign):
+    """Split line-aligned inputs into parts.
+
+    Args:
+        inputs: list of file objects.
+        outputs: outputs[p][k] is the file object of part p of inputs[k].
+        assign: function mapping (line number, line of inputs[0]) to a part index.
+
+    Returns:
+        the number of lines written to each part.
+
+    Raises:
+        ValueError: if the inputs do not have the same number of lines.
+    """
+    counts = [0] * len(outputs)
+    for x, lines in enumerate(itertools.izip_longest(*inputs)):
+        if None in lines:
+            raise ValueError('the inputs are not aligned: line %d is missing in some of them' % (x + 1))
+        p = assign(x, lines[0].rstrip('\n'))
+        for f, line in zip(outputs[p], lines):
+            f.write(line)
+        counts[p] += 1
+    return counts
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description='Split line-aligned files into parts in one pass.')
+    parser.add_argument('inputs', nargs='*', help='line-aligned input files (default: STDIN)')
+    parser.add_argument('--mode', choices=MODES, default=MODULO, help='assignment mode (default: modulo)')
+    parser.add_argument('--parts', required=True, type=parse_parts,
+                        help='comma-separated parts NAME[:WEIGHT] (default weight: 1)')
+    parser.add_argument('-o', '--output', action='append', required=True,
+                        help='output filename template of each input, containing {part}')
+    parser.add_argument('--base', type=int, default=0,
+                        help='number of the first line, in modulo mode (default: 0)')
+    parser.add_argument('--seed', default='', help='salt of the line hashes, in hash mode')
+    args = parser.parse_args()
+
+    if len(args.output) != max(len(args.inputs), 1):
+        parser.error('one -o is needed for each input')
+    if any('{part}' not in template for template in args.output):
+        parser.error('output templates must contain {part}')
+    names = [name for name, _ in args.parts]
+    weights = [weight for _, weight in args.parts]
+    if args.mode == MODULO:
+        assign = modulo_assigner(weights, args.base)
+    elif args.mode == HASH:
+        assign = hash_assigner(weights, args.seed)
+    else:
+        assign = ratio_assigner(weights)
+
+    inputs = [open(path, 'rb') for path in args.inputs] or [sys.stdin]
+    outputs = [[open(template.replace('{part}', name), 'wb') for template in args.output]
+               for name in names]
+    try:
+        counts = split(inputs, outputs, assign)
+    finally:
+        for f in inputs + [f for files in outputs for f in files]:
+            if f is not sys.stdin:
+                f.close()
+    print >>sys.stderr, ', '.join('%d lines in %s' % (n, name) for name, n in zip(names, counts))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,15 @@
 """
 Script to tokenize and normalize Lojban text.
+
+This runs the Lojban tokenizer of the web server (web/web/tokenize_jb.py),
+without splitting off brackets; see there for the options.
 """
+import os
 import sys
-import re
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'web', 'web'))
+
+import tokenize_jb
 
 
 def normalize(word):
@@ -12,19 +19,8 @@ def normalize(word):
 
 def tokenize(text):
     """Given a Lojban text, tokenize it to a list of words."""
-    tokens = [normalize(t) for t in re.split(' +', text)]
-
-    # remove the first 'i'
-    if len(tokens) > 0 and tokens[0] == 'i':
-        tokens = tokens[1:]
-    return tokens
-
+    return tokenize_jb.tokenize(text, brackets=False)
 
-def main():
-    """Main function"""
-    for line in sys.stdin:
-        tokens = tokenize(line.rstrip())
-        print ' '.join(tokens)
 
 if __name__ == '__main__':
-    main()
+    tokenize_jb.main()
@@ -7,28 +7,21 @@ rm -rf mert-work
 
 mkdir corpus
 
-python scripts/convert_solr_xml_to_bitext.py docs/aspect.xml > corpus/train
-python scripts/convert_solr_xml_to_bitext.py docs/cll.xml >> corpus/train
-python scripts/convert_solr_xml_to_bitext.py docs/conlang.xml >> corpus/train
-python scripts/convert_solr_xml_to_bitext.py docs/jbowiki.xml >> corpus/train
-python scripts/convert_solr_xml_to_bitext.py docs/phrasebook.xml >> corpus/train
-python scripts/convert_solr_xml_to_bitext.py docs/tatoeba.xml >> corpus/train
-python scripts/convert_solr_xml_to_bitext.py docs/teris.xml >> corpus/train
-python scripts/convert_solr_xml_to_bitext.py docs/introduction.xml >> corpus/train
-python scripts/convert_solr_xml_to_bitext.py docs/crashcourse1.xml >> corpus/train
-python scripts/convert_solr_xml_to_bitext.py docs/crashcourse.jbo_eng_dict.xml >> corpus/train
-python scripts/convert_solr_xml_to_bitext.py docs/zmifanva_reports.xml >> corpus/train
-
-# Preprocess corpus
-
-cat corpus/train | cut -f 1 | python scripts/tokenize_jbo.py > corpus/train.tok.jb
-cat corpus/train | cut -f 2 | mosesdecoder/scripts/tokenizer/tokenizer.perl -l en > corpus/train.tok.en
+# Convert, tokenize and clean the corpus, reusing the shards of unchanged files cached in corpus.cache/
+
+python scripts/build_corpus.py -j 4 --clean \
+    --en-tokenizer 'mosesdecoder/scripts/tokenizer/tokenizer.perl -l en' \
+    corpus/train docs/aspect.xml docs/cll.xml \
+    docs/conlang.xml docs/jbowiki.xml docs/phrasebook.xml docs/tatoeba.xml \
+    docs/teris.xml docs/introduction.xml docs/crashcourse1.xml \
+    docs/crashcourse.jbo_eng_dict.xml docs/zmifanva_reports.xml
 
 mosesdecoder/scripts/training/clean-corpus-n.perl corpus/train.tok jb en corpus/train.clean 1 80
 
-# Create dev set
+# Create dev and test sets (odd and even lines of crashcourse4)
 
-python scripts/convert_solr_xml_to_bitext.py docs/crashcourse4.xml | python scripts/mod.py --mod 2 -n 1 > corpus/dev
+python scripts/convert_solr_xml_to_bitext.py docs/crashcourse4.xml | \
+    python scripts/split_corpus.py --parts test,dev -o 'corpus/{part}'
 
 cat corpus/dev | cut -f 1 | python scripts/tokenize_jbo.py > corpus/dev.tok.jb
 cat corpus/dev | cut -f 2 | mosesdecoder/scripts/tokenizer/tokenizer.perl -l en > corpus/dev.tok.en
@@ -66,6 +59,18 @@ mosesdecoder/scripts/training/train-model.perl \
     -lm 0:3:$PWD/lm/train.blm.jb:8 \
     -external-bin-dir mosesdecoder/tools
 
+# Build single-word best-translation indexes for the web app
+
+python web/web/lexicon.py train.jb-en/model train.jb-en/model/best-translation.bin
+python web/web/lexicon.py train.en-jb/model train.en-jb/model/best-translation.bin
+
+# Build exact-match translation memories for the web app
+
+PYTHONPATH=web python -m web.translation_memory --jb2en tm/exact.jb2en.gz --en2jb tm/exact.en2jb.gz \
+    docs/aspect.xml docs/cll.xml docs/conlang.xml docs/jbowiki.xml docs/phrasebook.xml \
+    docs/tatoeba.xml docs/teris.xml docs/introduction.xml docs/crashcourse1.xml \
+    docs/crashcourse.jbo_eng_dict.xml docs/zmifanva_reports.xml
+
 #
 # mosesdecoder/scripts/training/mert-moses.pl \
 #     corpus/dev.tok.en corpus/dev.tok.jb \
@@ -77,8 +82,6 @@ mosesdecoder/scripts/training/train-model.perl \
 
 # Evaluate (jbo -> eng)
 
-python scripts/convert_solr_xml_to_bitext.py docs/crashcourse4.xml | python scripts/mod.py --mod 2 -n 0 > corpus/test
-
 cat corpus/test | cut -f 1 | python scripts/tokenize_jbo.py > corpus/test.tok.jb
 cat corpus/test | cut -f 2 | mosesdecoder/scripts/tokenizer/tokenizer.perl -l en > corpus/test.tok.en
 
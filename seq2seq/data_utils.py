@@ -26,7 +26,8 @@ import tarfile
 from tensorflow.python.platform import gfile
 from six.moves import urllib
 
-from tokenizer import split2
+from tokenizer import split2, split2_batch
+import token_ids as token_id_corpus
 
 # Special vocabulary symbols - we always put them at the start.
 _PAD = "_PAD"
@@ -120,6 +121,29 @@ def vva_tokenizer(sentence):
     return tokenized_sentence.split(' ')
 
 
+def vva_tokenizer_batch(sentences):
+    """Batch version of vva_tokenizer: yield the tokens of each sentence.
+
+    The sentences are tokenized in chunks by a pool of processes (one per CPU).
+    """
+    for tokens in split2_batch(sentences, processes=None):
+        yield ' '.join(tokens).encode('utf-8').split(' ')
+
+
+def tokenize_lines(lines, tokenizer=None):
+  """Yield the tokens of each line, using the batch tokenizer if there is one.
+
+  Args:
+    lines: iterable of sentences.
+    tokenizer: a function to use to tokenize each sentence;
+      if None, basic_tokenizer will be used.
+  """
+  if tokenizer is vva_tokenizer:
+    return vva_tokenizer_batch(lines)
+  tokenizer = tokenizer or basic_tokenizer
+  return (tokenizer(line) for line in lines)
+
+
 def lojban_tokenizer(sentence):
     """Tokenizer for Lojban - simply split by whitespace."""
 
@@ -149,11 +173,10 @@ def create_vocabulary(vocabulary_path, data_path, max_vocabulary_size,
     vocab = {}
     with gfile.GFile(data_path, mode="r") as f:
       counter = 0
-      for line in f:
+      for tokens in tokenize_lines(f, tokenizer):
         counter += 1
         if counter % 100000 == 0:
           print("  processing line %d" % counter)
-        tokens = tokenizer(line) if tokenizer else basic_tokenizer(line)
         for w in tokens:
           word = re.sub(_DIGIT_RE, "0", w) if normalize_digits else w
           if word in vocab:
@@ -220,6 +243,11 @@ def sentence_to_token_ids(sentence, vocabulary,
     words = tokenizer(sentence)
   else:
     words = basic_tokenizer(sentence)
+  return words_to_token_ids(words, vocabulary, normalize_digits)
+
+
+def words_to_token_ids(words, vocabulary, normalize_digits=True):
+  """Convert a list of tokens to a list of token-ids, see sentence_to_token_ids."""
   if not normalize_digits:
     return [vocabulary.get(w, UNK_ID) for w in words]
   # Normalize digits by 0 before looking words up in the vocabulary.
@@ -232,7 +260,10 @@ def data_to_token_ids(data_path, target_path, vocabulary_path,
 
   This function loads data line-by-line from data_path, calls the above
   sentence_to_token_ids, and saves the result to target_path. See comment
-  for sentence_to_token_ids on the details of token-ids format.
+  for sentence_to_token_ids on the details of token-ids format. The token-ids
+  are also written in the binary format of token_ids.py (target_path.bin and
+  target_path.idx, on the local file system), which translate.read_data
+  memory-maps; it is created from target_path if only that exists.
 
   Args:
     data_path: path to the data file in one-sentence-per-line format.
@@ -245,16 +276,21 @@ def data_to_token_ids(data_path, target_path, vocabulary_path,
   if not gfile.Exists(target_path):
     print("Tokenizing data in %s" % data_path)
     vocab, _ = initialize_vocabulary(vocabulary_path)
+    writer = token_id_corpus.TokenIdWriter(target_path)
     with gfile.GFile(data_path, mode="r") as data_file:
       with gfile.GFile(target_path, mode="w") as tokens_file:
         counter = 0
-        for line in data_file:
+        for words in tokenize_lines(data_file, tokenizer):
           counter += 1
           if counter % 100000 == 0:
             print("  tokenizing line %d" % counter)
-          token_ids = sentence_to_token_ids(line, vocab, tokenizer,
-                                            normalize_digits)
+          token_ids = words_to_token_ids(words, vocab, normalize_digits)
           tokens_file.write(" ".join([str(tok) for tok in token_ids]) + "\n")
+          writer.write(token_ids)
+    writer.close()
+  elif not token_id_corpus.exists(target_path):
+    print("Writing binary token-ids of %s" % target_path)
+    token_id_corpus.text_to_binary(target_path)
 
 
 def prepare_jb_en_data(data_dir, en_vocabulary_size, jb_vocabulary_size):
@@ -0,0 +1,155 @@
+"""Binary, memory-mapped token-id corpus format.
+
+A corpus of N sentences written to the text token-id file PATH by
+data_utils.data_to_token_ids() is also stored in two binary files:
+
+    PATH.bin  the token-ids of all the sentences back to back (little-endian int32)
+    PATH.idx  N + 1 offsets into PATH.bin (little-endian int64); the token-ids
+              of sentence i are bin[idx[i]:idx[i + 1]]
+
+Both files are memory-mapped when read, so a corpus loads instantly and
+only the pages of the sentences actually used are resident. bucket_corpus()
+sorts the sentence pairs of a corpus into buckets (see translate.read_data())
+without reading their token-ids.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import numpy as np
+
+BIN_SUFFIX = ".bin"
+IDX_SUFFIX = ".idx"
+
+_ID_DTYPE = np.dtype("<i4")
+_OFFSET_DTYPE = np.dtype("<i8")
+
+
+def exists(path):
+    """Return whether the binary files of the token-id corpus at path exist."""
+    return os.path.exists(path + BIN_SUFFIX) and os.path.exists(path + IDX_SUFFIX)
+
+
+class TokenIdWriter(object):
+    """Write a binary token-id corpus, one sentence at a time.
+
+    The files are written under temporary names and renamed by close(), so a
+    corpus is never left half-written.
+    """
+
+    # Number of token-ids buffered before they are written.
+    BUFFER_SIZE = 1 << 16
+
+    def __init__(self, path):
+        self.path = path
+        self._ids_file = open(path + BIN_SUFFIX + ".tmp", "wb")
+        self._buffer = []
+        self._offsets = [0]
+
+    def write(self, token_ids):
+        """Append a sentence (list of token-ids)."""
+        self._buffer.extend(token_ids)
+        self._offsets.append(self._offsets[-1] + len(token_ids))
+        if len(self._buffer) >= self.BUFFER_SIZE:
+            self._flush()
+
+    def _flush(self):
+        np.array(self._buffer, dtype=_ID_DTYPE).tofile(self._ids_file)
+        self._buffer = []
+
+    def close(self):
+        self._flush()
+        self._ids_file.close()
+        np.array(self._offsets, dtype=_OFFSET_DTYPE).tofile(self.path + IDX_SUFFIX + ".tmp")
+        # The index is renamed last: exists() is only true for a complete corpus.
+        os.rename(self.path + BIN_SUFFIX + ".tmp", self.path + BIN_SUFFIX)
+        os.rename(self.path + IDX_SUFFIX + ".tmp", self.path + IDX_SUFFIX)
+
+
+def text_to_binary(path):
+    """Write the binary files of the text token-id file at path (one sentence per line)."""
+    writer = TokenIdWriter(path)
+    with open(path) as f:
+        for line in f:
+            writer.write([int(x) for x in line.split()])
+    writer.close()
+
+
+class TokenIdCorpus(object):
+    """Read-only, memory-mapped binary token-id corpus."""
+
+    def __init__(self, path):
+        self.offsets = np.memmap(path + IDX_SUFFIX, dtype=_OFFSET_DTYPE, mode="r")
+        if os.path.getsize(path + BIN_SUFFIX) > 0:
+            self.ids = np.memmap(path + BIN_SUFFIX, dtype=_ID_DTYPE, mode="r")
+        else:
+            # An empty file cannot be memory-mapped.
+            self.ids = np.zeros(0, dtype=_ID_DTYPE)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        """Return the token-ids of sentence i (a read-only int32 array)."""
+        return self.ids[self.offsets[i]:self.offsets[i + 1]]
+
+    def lengths(self):
+        """Return the number of token-ids of every sentence (an int64 array)."""
+        return np.diff(self.offsets)
+
+
+class Bucket(object):
+    """Sequence of the (source_ids, target_ids) pairs of a bucket.
+
+    The pairs are built from the memory-mapped corpora when they are accessed,
+    as lists of ints; EOS is appended to the target.
+    """
+
+    def __init__(self, source, target, indices, eos_id):
+        self.source = source
+        self.target = target
+        self.indices = indices
+        self.eos_id = eos_id
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, k):
+        i = self.indices[k]
+        return [self.source[i].tolist(), self.target[i].tolist() + [self.eos_id]]
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self[k]
+
+
+def bucket_corpus(source, target, buckets, eos_id, max_size=None):
+    """Sort aligned source and target corpora into buckets.
+
+    Args:
+        source: TokenIdCorpus of the source language.
+        target: TokenIdCorpus of the target language, aligned with source.
+        buckets: list of (source size, target size) pairs.
+        eos_id: token-id appended to every target.
+        max_size: maximum number of sentence pairs to use, all other will be
+          ignored; if 0 or None, the corpora are used completely (no limit).
+
+    Returns:
+        a list of len(buckets) Buckets; the n-th one contains the pairs, in
+        corpus order, that fit into the n-th bucket and not into an earlier one,
+        i.e., such that len(source) < buckets[n][0] and len(target) + 1 < buckets[n][1].
+    """
+    n = min(len(source), len(target))
+    if max_size:
+        n = min(n, max_size)
+    source_lengths = source.lengths()[:n]
+    target_lengths = target.lengths()[:n] + 1
+    assigned = np.zeros(n, dtype=bool)
+    data_set = []
+    for source_size, target_size in buckets:
+        fits = (source_lengths < source_size) & (target_lengths < target_size) & ~assigned
+        assigned |= fits
+        data_set.append(Bucket(source, target, np.flatnonzero(fits), eos_id))
+    return data_set
@@ -23,7 +23,7 @@ __copyright__ = "Copyright (c) 2010 CLiPS"
 # Note for developers: 
 # For performance, always compile regular expressions once, outside of the functions.
 
-import re, sys, getopt
+import re, sys, getopt, threading, bisect, random, time, collections, multiprocessing
 
 PUNCTUATION = [ch for ch in """(){}[]<>!?.:;,`'"@#$%^&*+-|=~/\\_"""]
 LETTERS     = [ch for ch in "abcdefghijklmnopqrstuvwxyz"]
@@ -40,6 +40,84 @@ is_int = lambda s: digits.search(s) != None
 # regex pattern for entities: &amp; &#164;
 entity = "&[a-z]+;|&#[0-9]+;"
 
+#### CACHE ###########################################################################################
+# Token frequencies are extremely Zipfian ("Mr.", "don't", "10km."), so the expensive per-token
+# functions below remember their results for the most recently used tokens.
+
+class TokenCache(object):
+    
+    def __init__(self, size=10000):
+        """ A bounded least-recently-used cache of per-token results.
+            Once the cache holds size tokens, storing a new token evicts the least recently used one.
+            The hits and misses counters are reported by stats().
+        """
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._map = {} # token => link
+        # Circular doubly linked list of [previous, next, token, value] links,
+        # from the least recently used to the most recently used token.
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+        
+    def __len__(self):
+        return len(self._map)
+        
+    def get(self, token, default=None):
+        """ Returns the value stored for the token and marks it as most recently used,
+            or the default if the token is not in the cache.
+        """
+        with self._lock:
+            link = self._map.get(token)
+            if link is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            previous, next, _, value = link
+            previous[1] = next
+            next[0] = previous
+            last = self._root[0]
+            last[1] = self._root[0] = link
+            link[0] = last
+            link[1] = self._root
+            return value
+            
+    def put(self, token, value):
+        """ Stores the value for the token, evicting the least recently used token if the cache is full.
+        """
+        with self._lock:
+            if token in self._map:
+                self._map[token][3] = value
+                return
+            root = self._root
+            if len(self._map) >= self.size:
+                oldest = root[1]
+                root[1] = oldest[1]
+                oldest[1][0] = root
+                del self._map[oldest[2]]
+            last = root[0]
+            link = [last, root, token, value]
+            last[1] = root[0] = self._map[token] = link
+            
+    def clear(self):
+        with self._lock:
+            self._map.clear()
+            self._root[:] = [self._root, self._root, None, None]
+            self.hits = self.misses = 0
+            
+    def stats(self):
+        """ Returns a dictionary with the hits, misses, hit rate, current and maximum size of the cache.
+        """
+        n = self.hits + self.misses
+        return {
+            "hits"     : self.hits,
+            "misses"   : self.misses,
+            "hit_rate" : n and float(self.hits) / n or 0.0,
+            "tokens"   : len(self._map),
+            "size"     : self.size
+        }
+
 #### RANGES ##########################################################################################
 # Sets that match a range of words: all abbreviations, all numeric strings, all hyperlinks, ...
 # The Range class is a dictionary enriched with regular expression patterns.
@@ -60,8 +138,16 @@ class Range(dict):
         return False
 
 def in_any(word, ranges=[]):
+    if which_range(word, ranges) is not None: return True
+
+def which_range(word, ranges=[]):
+    """ Returns the first range in the list that contains the word, or None.
+    """
+    if isinstance(ranges, RangeMatcher):
+        return ranges.match(word)
     for rng in ranges:
-        if word in rng: return True
+        if word in rng: return rng
+    return None
 
 #--- ABBREVIATIONS -----------------------------------------------------------------------------------
 
@@ -133,13 +219,14 @@ currencies.patterns = [re.compile('^'+re.escape(x)) for x in currencymarkers]
 
 class Numeric(Range):
     
-    def __init__(self, units=[], punctuation="\.,:/"):
+    def __init__(self, units=[], punctuation="\.,:/", cache_size=1000):
         """ A range for numeric strings.
             word in Numeric() == True for 0, 0-0, 000.0, 00/00/00, 00:00, 0km, 0.0KB ... 
             The range will match anything that starts with a digit
             followed by a chain of digits and .,:/ separators,
             as long as the last character is a digit,
             optionally followed by a unit of measurement.
+            The result for the cache_size most recently checked words is cached.
         """
         Range.__init__(self)
         self.units = dict.fromkeys(units, True)
@@ -147,30 +234,36 @@ class Numeric(Range):
         # with a mix of digits and punctuation in between, suffixed by a unit.
         # Note the 4: this is the maximum unit length.
         self.patterns = [re.compile("^(\d*["+punctuation+"])*(\d+)(.{0,4})$")]
-        self._cache = ("", "", False) # (word, unit suffix, is number?)
+        self._cache = TokenCache(cache_size) # word => (unit suffix, is number?)
+        self._last = ""
+        
+    def _lookup(self, word):
+        self._last = word
+        v = self._cache.get(word)
+        if v is None:
+            if len(word) > 0 and word[0].isalpha(): 
+                u, b = "", False
+            else:
+                m = self.patterns[0].search(word)
+                u = m!=None and m.group(3) or ""
+                b = m!=None and u=="" or u in self.units
+            v = (u, b)
+            self._cache.put(word, v)
+        return v
         
     def __contains__(self, word):
-        if self._cache[0] == word:
-            return self._cache[2]
-        elif len(word) > 0 and word[0].isalpha(): 
-            u, b = "", False
-        else:
-            m = self.patterns[0].search(word)
-            u = m!=None and m.group(3) or ""
-            b = m!=None and u=="" or u in self.units
-        self._cache = (word, u, b)
-        return b
+        return self._lookup(word)[1]
 
     def unit(self, word):
-        """ Yields the unit suffix of the last word checked, e.g. 1000km => km
+        """ Yields the unit suffix of the word, e.g. 1000km => km
         """
-        if word != self._cache[0]: 
-            word in self
-        return self._cache[1]
+        return self._lookup(word)[0]
     
     @property
     def cached(self):
-        return self._cache[0]
+        """ Yields the last word checked.
+        """
+        return self._last
 
 numeric = Numeric(units)
 
@@ -232,6 +325,65 @@ class Entities(Range):
 
 entities = Entities()
 
+#--- COMBINED RANGES ---------------------------------------------------------------------------------
+
+class RangeMatcher(list):
+    
+    def __init__(self, ranges=[]):
+        """ A list of ranges with a single compiled matcher: in_any(word, RangeMatcher(ranges))
+            is equivalent to in_any(word, ranges), but probes one dictionary and one regular
+            expression instead of each range and each pattern in turn.
+            The dictionaries and patterns of Range and Abbreviations objects are merged
+            (in list order, so the first range still wins); other ranges with their own
+            __contains__ (Numeric, Entities) are only checked if no earlier range matched.
+            The ranges should not be modified afterwards.
+        """
+        list.__init__(self, ranges)
+        self.known = {}    # word => index of the first range with the word in its dictionary
+        self.groups = {}   # group name => index of the range
+        self.others = []   # (index, range) checked with "word in range"
+        alternatives = []
+        for i, rng in reversed(list(enumerate(ranges))):
+            if type(rng) in (Range, Abbreviations, UniformResourceIdentifiers):
+                self.known.update((word, i) for word in dict.keys(rng) if word in rng)
+        for i, rng in enumerate(ranges):
+            if type(rng) in (Range, Abbreviations, UniformResourceIdentifiers):
+                if not rng.patterns: 
+                    continue
+                # Range uses search(), anchor each pattern at the start of the word.
+                patterns = [p.pattern[1:] if p.pattern.startswith("^") else "[\s\S]*?(?:"+p.pattern+")" 
+                    for p in rng.patterns]
+                patterns = "|".join("(?:"+p+")" for p in patterns)
+                if isinstance(rng, Abbreviations):
+                    patterns = "(?=[\s\S]*\.\Z)(?:"+patterns+")"
+                self.groups["r%d" % i] = i
+                alternatives.append("(?P<r%d>%s)" % (i, patterns))
+            else:
+                self.others.append((i, rng))
+        self.pattern = alternatives and re.compile("|".join(alternatives)) or None
+        
+    def match(self, word):
+        """ Returns the first range that contains the word, or None.
+        """
+        n = len(self)
+        i = self.known.get(word, n)
+        if self.pattern is not None:
+            m = self.pattern.match(word)
+            if m is not None:
+                i = min(i, self.groups[m.lastgroup])
+        for j, rng in self.others:
+            if j >= i:
+                break
+            if word in rng:
+                i = j
+                break
+        if i < n:
+            return self[i]
+        return None
+
+# Known words that should not be split: abbreviations, numbers, hyperlinks and entities.
+known_ranges = RangeMatcher([abbreviations, numeric, URI, entities])
+
 ##### SPLITTERS ######################################################################################
 # Functions that split words, punctuation, sentences. 
 
@@ -423,7 +575,7 @@ def assert_split(a, b, c, sets=[]):
             return None, None, None
     return a, b, c
 
-def split_missing_space(word, ignore=[abbreviations, numeric, URI, entities]):
+def split_missing_space(word, ignore=known_ranges):
     """ Splits words that are probably two word with missing punctuation in between.
         Returns the expanded form of the word as a list of strings, i.e.
         nice;also => ["nice", ";", "also"]
@@ -483,7 +635,7 @@ def split_chars(word, chunk=".-"):
             p.append(ch)
     return p[1:] or [""]
 
-def split_punctuation(word, ignore=[abbreviations, numeric, URI, entities]):
+def split_punctuation(word, ignore=known_ranges):
     """ Splits punctuation from the head and tail of the word.
         Returns the expanded form of the word as a list of strings, i.e.
         goodbye. => ["goodbye", "."]
@@ -548,6 +700,21 @@ def split_punctuation(word, ignore=[abbreviations, numeric, URI, entities]):
 
 #---- WORDS ------------------------------------------------------------------------------------------
 
+# Patterns used by split_words(), compiled once per set of keepers.
+# For each keeper: (keeper, pattern for a run of keepers/whitespace, pattern for whitespace around a newline),
+# and finally a pattern for a run of the other whitespace characters.
+split_words_patterns = {}
+
+def compile_split_words_patterns(keep="\n"):
+    if keep not in split_words_patterns:
+        keepers = [(ch, re.compile(ch+"["+ch+"|\s]+"), re.compile("\s{0,1}\n\s{0,1}")) for ch in keep]
+        spaces = [ch for ch in WHITESPACE if ch not in keep]
+        spaces = spaces and re.compile("["+"".join(spaces)+"]+") or None
+        split_words_patterns[keep] = (keepers, spaces)
+    return split_words_patterns[keep]
+
+compile_split_words_patterns("\n")
+
 def split_words(string, keep="\n"):
     """ Returns a list of words in the given string.
         All whitespace characters except those defined as keepers are replaced by a standard space.
@@ -556,23 +723,37 @@ def split_words(string, keep="\n"):
         Words can contain punctuation marks at the start or end, we need to process these separately.
         We retain \n (newline) in the output is because we need it to process hyphenation.
     """
-    w = "|".join(filter(lambda ch: ch not in keep, WHITESPACE))
-    for ch in keep:
+    keepers, spaces = compile_split_words_patterns(keep)
+    for ch, collapse, surround in keepers:
         # Collapse keepers, e.g, "\n \n" => "\n".
         # We will be splitting on spaces in a minute,
         # so ensure there is a space around each keeper.
-        string = re.sub(ch+"["+ch+"|\s]+", ch, string)
-        string = re.sub("\s{0,1}\n\s{0,1}", " "+ch+" ", string)
+        string = collapse.sub(ch, string)
+        string = surround.sub(" "+ch+" ", string)
     string = string.strip()
-    string = re.compile(w).sub(" ", string)
-    string = re.sub(" +", " ", string)
-    return string.split(" ")
+    if spaces is None:
+        return string.split(" ")
+    return spaces.split(string)
+
+# Results of split_word() for the most recently used tokens.
+SPLIT_WORD_CACHE_SIZE = 50000
+split_word_cache = TokenCache(SPLIT_WORD_CACHE_SIZE)
 
-def split_word(word, ignore=[abbreviations, numeric, URI, entities]):
+def split_word(word, ignore=known_ranges):
     """ Splits contracted words, joined words with a missing space, punctuation.
         Returns the expanded form of the word as a list of strings, i.e.
         can't... => ["cannot", "..."]
+        Results for the default ignore list are cached in split_word_cache.
     """
+    if ignore is not known_ranges:
+        return _split_word(word, ignore)
+    a = split_word_cache.get(word)
+    if a is None:
+        a = tuple(_split_word(word, ignore))
+        split_word_cache.put(word, a)
+    return list(a)
+
+def _split_word(word, ignore=known_ranges):
     if word.lower() == 'cannot':
         #Special rule for cannot because the split_contraction is not called on all alpha words
         a=[word]
@@ -647,21 +828,29 @@ def prohibited_sentence_break(words=[]):
     '''Ad hoc function that makes that the patterns in nobreak
     are preserved.
     
-    Returns a list of token indices that cannot be preceded by a sentence break. 
+    Returns a set of token indices that cannot be preceded by a sentence break. 
     '''
-    output=[]; links=[]
-    for i,word in enumerate(words):
-        links.extend([i for j in range(len(word))])
+    output=set()
+    # Character offset in the joined string where each word starts.
+    starts=[]; offset=0
+    for word in words:
+        starts.append(offset)
+        offset += len(word)
 
     string =  ''.join(words)
     for prohibited in nobreak:
         for m in prohibited.finditer(string):        
-            start = links[m.start()]+1
-            stop = links[m.end()]
+            # Index of the word containing the first character of the match, and of the word
+            # containing the first character after the match (len(words) at the end of the string).
+            start = bisect.bisect_right(starts, m.start())
+            if m.end() < offset:
+                stop = bisect.bisect_right(starts, m.end())-1
+            else:
+                stop = len(words)
             if start == stop:     
-                output.append(start)
+                output.add(start)
             else:
-                output.extend(range(start, stop))
+                output.update(range(start, stop))
 
     return output 
     
@@ -766,6 +955,28 @@ def split_lists(words=[], marker=SENTENCE_BREAK):
             p.append(word)
     return p
 
+#--- LINES -------------------------------------------------------------------------------------------
+
+# Whitespace except newlines, see split_words().
+spaces = split_words_patterns["\n"][1]
+
+def split_lines(string, marker=SENTENCE_BREAK):
+    """ Returns the list of words in the given string, with list item sentence breaks added
+        and line-wrapped hyphenation joined, and without the \n items, i.e.
+        the same as split_hyphenation(split_lists(split_words(string))) minus the "\n" items.
+        A string without newlines (e.g. a single sentence), except maybe a final one
+        (e.g. a line read from a file), has no list items or hyphenation to process,
+        and is split in a single scan.
+    """
+    line = string[:-1] if string.endswith("\n") else string
+    if "\n" not in line:
+        # split_lists() only adds a sentence break before the first word.
+        return [marker] + spaces.split(line.strip())
+    words = split_words(string, keep="\n")
+    words = split_lists(words, marker)
+    words = split_hyphenation(words)
+    return [word for word in words if word != "\n"]
+
 ######################################################################################################
 
 # Punctuation replacements for unicode characters.
@@ -778,35 +989,36 @@ unicode_replacements = {
                  u"»" : ">>",
 }
 
-def split(string, tags=True, replace=unicode_replacements):
-    """ Splits the string into a list of sentences.
-        Punctuation is split from words as individual tokens.
-        With tags=False, removes SGML-tags (i.e. anything resembling "<...>") first.
-        The replace dictionary contains (unicode) strings to normalize.
+def replacement_table(replace=unicode_replacements):
+    """ Returns a unicode.translate() table for the given replace dictionary,
+        mapping each character of each key to its replacement.
+    """
+    return dict((ord(ch), unicode(v)) for k, v in replace.items() for ch in k)
+
+unicode_replacement_table = replacement_table(unicode_replacements)
+
+def normalize_unicode(string, replace=unicode_replacements):
+    """ Replaces every character in the keys of the replace dictionary with its value,
+        in a single pass over the (unicode) string.
+    """
+    if replace is unicode_replacements:
+        table = unicode_replacement_table
+    else:
+        table = replacement_table(replace)
+    return string.translate(table)
+
+def split_list_words(words=[], marker=SENTENCE_BREAK):
+    """ Returns the list of tokens of each word in the list returned by split_lines(),
+        splitting words with missing spaces, contractions, etc. (see split_word()),
+        but keeping numbered list item markers intact (e.g. "2." after "1.").
     """
-    # Make sure we have a unicode string.
-    if isinstance(string, str):
-        string = string.decode("utf-8")
-    for k,v in replace.items():
-        for k in k:
-            string = re.sub(k,v, string)
-    if not tags:
-        string = strip_tags(string)
-    # Collapse whitespace and split on each space.
-    # We keep \n as a separate token because we still need it to check lists and hyphenation.
-    words = split_words(string, keep="\n")
-    words = split_lists(words)
-    words = split_hyphenation(words)
-    words = [word for word in words if word != "\n"]
-    # Split words with missing spaces, contractions, etc.
-    # Keep list item markers at the start of the sentence intact - see split_lists().
     p = []
     list_marker_encounter=None
     for i, word in enumerate(words):
         list_marker_char = list_marker.search(word)
         if list_marker_char is not None:
-            if i==0 or words[i-1] == SENTENCE_BREAK:
-                p.append(word)
+            if i==0 or words[i-1] == marker:
+                p.append([word])
                 
                 try:
                     list_marker_encounter=int(list_marker_char.group().rstrip('.'))
@@ -832,21 +1044,44 @@ def split(string, tags=True, replace=unicode_replacements):
                     else:
                         if next == clm:
                             #This means that we are in the special case (the first 4.), so just split this occurrence
-                            p.extend(split_word(word))
+                            p.append(split_word(word))
                             continue
                             
                 if clm == list_marker_encounter+1:
                     # Only don't split 2. etc. if we already saw a listmarker 1.
-                    p.append(word)
+                    p.append([word])
                     list_marker_encounter = clm
                 else:
                     #Split normally
-                    p.extend(split_word(word))
+                    p.append(split_word(word))
             else:
                 #Split normally
-                p.extend(split_word(word))
+                p.append(split_word(word))
         else:
-            p.extend(split_word(word))
+            p.append(split_word(word))
+    return p
+
+def split(string, tags=True, replace=unicode_replacements):
+    """ Splits the string into a list of sentences.
+        Punctuation is split from words as individual tokens.
+        With tags=False, removes SGML-tags (i.e. anything resembling "<...>") first.
+        With tags=True, the output is verified with check(), see check_policy.
+        The replace dictionary contains (unicode) strings to normalize.
+    """
+    # Make sure we have a unicode string.
+    if isinstance(string, str):
+        string = string.decode("utf-8")
+    string = normalize_unicode(string, replace)
+    if not tags:
+        string = strip_tags(string)
+    # Collapse whitespace and split on each space.
+    # We keep \n as a separate token because we still need it to check lists and hyphenation.
+    words = split_lines(string)
+    # Split words with missing spaces, contractions, etc.
+    # Keep list item markers at the start of the sentence intact - see split_lists().
+    p = []
+    for tokens in split_list_words(words):
+        p.extend(tokens)
     # Add sentence breaks after periods and other punctuation that indicate the end of the sentence.
     # Parse sentence breaks and create a list of individual sentence strings.
     p = add_sentence_breaks(p)
@@ -854,7 +1089,7 @@ def split(string, tags=True, replace=unicode_replacements):
     p = [" ".join(sentence) for sentence in p]
     
     if tags:
-        check(string, '\n'.join(p))
+        verify(string, p)
     
     return p
     
@@ -862,22 +1097,26 @@ def split2(string, tags=True, replace=unicode_replacements):
     """ Does NOT split the string into a list of sentences.
         Punctuation is split from words as individual tokens.
         With tags=False, removes SGML-tags (i.e. anything resembling "<...>") first.
+        With tags=True, the output is verified with check(), see check_policy.
         The replace dictionary contains (unicode) strings to normalize.
     """
+    string, p = _split2(string, tags, replace)
+    if tags:
+        verify(string, p)
+    return p
+
+def _split2(string, tags=True, replace=unicode_replacements):
+    """ Returns the normalized string and the output of split2(), which is not verified.
+    """
     # Make sure we have a unicode string.
     if isinstance(string, str):
         string = string.decode("utf-8")
-    for k,v in replace.items():
-        for k in k:
-            string = re.sub(k,v, string)
+    string = normalize_unicode(string, replace)
     if not tags:
         string = strip_tags(string)
     # Collapse whitespace and split on each space.
     # We keep \n as a separate token because we still need it to check lists and hyphenation.
-    words = split_words(string, keep="\n")
-    words = split_lists(words)
-    words = split_hyphenation(words)
-    words = [word for word in words if word != "\n"]
+    words = split_lines(string)
     # Split words with missing spaces, contractions, etc.
     # Keep list item markers at the start of the sentence intact - see split_lists().
     p = []
@@ -895,86 +1134,302 @@ def split2(string, tags=True, replace=unicode_replacements):
     #p = add_sentence_breaks(p)
     p = split_sentences(p)
     p = [" ".join(sentence) for sentence in p]
-    
-    if tags:
-        check(string, '\n'.join(p))
-    
+    return string, p
+
+
+#--- OFFSETS -----------------------------------------------------------------------------------------
+# split_spans() tokenizes like split() or split2(), and also yields the character offsets
+# of each token and sentence in the original string.
+
+# A run of characters that are not split_words() whitespace.
+nonspace = re.compile("[^ \t\n\r\f\v]+")
+
+def normalized_offsets(string, replace=unicode_replacements):
+    """ Returns, for each character of normalize_unicode(string, replace), followed by its end,
+        the offset of the character it was replaced from in the string,
+        or None if the normalization does not change the length of the string.
+    """
+    if replace is unicode_replacements:
+        table = unicode_replacement_table
+    else:
+        table = replacement_table(replace)
+    offsets = []
+    for i, ch in enumerate(string):
+        v = table.get(ord(ch), ch)
+        offsets.extend([i] * len(v or ""))
+    offsets.append(len(string))
+    if len(offsets) == len(string)+1:
+        return None
+    return offsets
+
+def word_offsets(string, words=[], marker=SENTENCE_BREAK):
+    """ Returns the position in the string of each word in the list returned by split_lines(string),
+        as a list of (word offset, string offset) segments: the character at offset k in the word
+        is at string offset + k - word offset of the last segment with word offset <= k.
+        Words joined by split_hyphenation() have two segments, other words one.
+        Sentence break markers have no segments.
+    """
+    p, i = [], 0
+    for word in words:
+        if word == marker:
+            p.append([])
+            continue
+        m = nonspace.search(string, i)
+        if m is not None and string.startswith(word, m.start()):
+            p.append([(0, m.start())])
+            i = m.start() + len(word)
+            continue
+        # Line-wrapped hyphenation: "mar- \nket" => "market", "Great- \nBritain" => "Great-Britain".
+        n = m is not None and nonspace.search(string, m.end()) or None
+        if n is not None and "\n" in string[m.end():n.start()]:
+            w1, w2 = m.group(), n.group()
+            if word == w1 + w2:
+                p.append([(0, m.start()), (len(w1), n.start())])
+                i = n.end()
+                continue
+            if word == w1[:-1] + w2:
+                p.append([(0, m.start()), (len(w1)-1, n.start())])
+                i = n.end()
+                continue
+        # Characters dropped by split_words(), e.g. the | in "\n| ".
+        j = string.find(word, i)
+        if j < 0:
+            raise ValueError("Not alignable: %s" % repr(word))
+        p.append([(0, j)])
+        i = j + len(word)
     return p
-    
-    
+
+def _offset(segments, k):
+    for w, o in reversed(segments):
+        if w <= k:
+            return o + k - w
+
+def split_spans(string, sentences=True, replace=unicode_replacements):
+    """ Splits the string into a list of sentences, like split(),
+        or, with sentences=False, into lines like split2().
+        Each sentence is a (start, stop, tokens) tuple and each token a (token, start, stop) tuple,
+        where string[start:stop] is the original text of the sentence or token
+        (e.g. "…" for the token "...").
+        The offsets are computed while tokenizing, so no alignment or check() is needed afterwards.
+    """
+    if isinstance(string, str):
+        string = string.decode("utf-8")
+    normalized = normalize_unicode(string, replace)
+    offsets = normalized_offsets(string, replace)
+    words = split_lines(normalized)
+    segments = word_offsets(normalized, words)
+    if sentences:
+        tokens = split_list_words(words)
+    else:
+        # Keep list item markers at the start of the line intact, like split2().
+        tokens = []
+        for i, word in enumerate(words):
+            if i==0 or words[i-1] == SENTENCE_BREAK and list_marker.search(word) != None:
+                tokens.append([word])
+            else:
+                tokens.append(split_word(word))
+    p, spans = [], []
+    for word, t, segs in zip(words, tokens, segments):
+        if word == SENTENCE_BREAK:
+            p.append(word)
+            continue
+        # The tokens of a word are its characters, except for the whitespace around them.
+        k = 0
+        aligned = "".join(t) == word
+        for token in t:
+            if not aligned:
+                k, token_len = 0, len(word)
+            else:
+                token_len = len(token)
+            start = stop = _offset(segs, k)
+            if token_len > 0:
+                stop = _offset(segs, k+token_len-1)+1
+            if offsets is not None:
+                start, stop = offsets[start], stop > start and offsets[stop-1]+1 or offsets[start]
+            if aligned:
+                k += token_len
+            p.append(token)
+            spans.append((token, start, stop))
+    if sentences:
+        p = add_sentence_breaks(p)
+    # add_sentence_breaks() only adds markers, so the tokens are still in the order of spans.
+    s, i = [[]], 0
+    for token in p:
+        if token == SENTENCE_BREAK:
+            s.append([])
+        else:
+            s[-1].append(spans[i])
+            i += 1
+    return [(sentence[0][1], sentence[-1][2], sentence) for sentence in s if len(sentence) > 0]
+
 def sentence_split(string, tags):
     '''Splits in sentences without tokenisation
     
     tags: not used'''
-    string = string.decode('utf8')
-    
-    output=[]
-    i=0
-    start=0
-    stop=0
-    data = split(string)
-    for s in data:
-        for c in s:
-            if c == string[i]:
-                stop+=1
-                i+=1
-            elif c.strip():
-                if string[i].strip():
-                    print 'c', repr(c)
-                    print 'i', i
-                    print 'string[i]', repr(string[i])
-                    print 'ss', start, stop, repr(string[start:stop])
-                    raise ValueError('Not alignable')
-                else:
-                    while not string[i].strip():
-                        i+=1
-                        stop+=1
-                    if c == string[i]:
-                        stop+=1
-                        i+=1
-                    elif c.strip():
-                        print 'c', repr(c)
-                        print 'i', i
-                        print 'string[i]', repr(string[i])
-                        print 'ss', start, stop, repr(string[start:stop])
-                        raise ValueError('Not alignable 2')
-                        
-                    
-        #We got all chars
-        output.append(string[start:stop].strip())
-        start = stop
-        stop = start
-        
-    if stop != len(string.strip()):
-        print >>sys.stderr, 'stop', stop
-        print >>sys.stderr, 'len', len(string.strip())
-        print 'output', output
-        raise ValueError('Did not cover all chars')
-        
-    if len(output) != len(data):
-        raise ValueError('Did retrieve all sentences')
-        
-    return output
-    
-    
-    
-    
-    
+    if isinstance(string, str):
+        string = string.decode("utf-8")
+    return [string[start:stop] for start, stop, tokens in split_spans(string)]
     
-
 #####################################################################################################
 
+def same_chars(original, tokenized):
+    """ Returns True if both strings have the same non-whitespace characters.
+    """
+    return ''.join(original.split()) == ''.join(tokenized.split())
+
 def check(original, tokenized):
     '''Takes the original string and the tokenized string and returns True if every non-white character
     of original is in tokenized. Otherwise raises an error'''
-    if ''.join(original.split()) != ''.join(tokenized.split()):
+    if not same_chars(original, tokenized):
         print >>sys.stderr, 'Original:', original
         print >>sys.stderr, 'O', len(''.join(original.split())), ''.join(original.split())
         print >>sys.stderr, 'T', len(''.join(tokenized.split())), ''.join(tokenized.split())
         raise ValueError('not the same chars')
     
     return True
+
+# Verification policy of split() and split2() with tags=True:
+# check every output (CHECK_ALWAYS), a random fraction check_rate of them (CHECK_SAMPLED), or none.
+# check() strips and compares both strings, a cost we don't want to pay on every request in production.
+CHECK_ALWAYS  = "always"
+CHECK_SAMPLED = "sampled"
+CHECK_NEVER   = "never"
+check_policy  = CHECK_ALWAYS
+check_rate    = 0.01
+
+# Number of verified, skipped and mismatching outputs.
+check_counts = {"checked": 0, "skipped": 0, "mismatches": 0}
+
+def set_check_policy(policy, rate=None):
+    """ Sets the verification policy (CHECK_ALWAYS, CHECK_SAMPLED or CHECK_NEVER) and the sampling rate.
+    """
+    global check_policy, check_rate
+    if policy not in (CHECK_ALWAYS, CHECK_SAMPLED, CHECK_NEVER):
+        raise ValueError("unknown check policy: %s" % policy)
+    check_policy = policy
+    if rate is not None:
+        check_rate = float(rate)
+
+def verify(original, sentences):
+    """ Verifies the list of tokenized sentences with check() according to check_policy,
+        counting the checked, skipped and mismatching outputs in check_counts.
+        Mismatches raise a ValueError, like check().
+    """
+    if check_policy == CHECK_NEVER \
+    or check_policy == CHECK_SAMPLED and random.random() >= check_rate:
+        check_counts["skipped"] += 1
+        return True
+    check_counts["checked"] += 1
+    try:
+        return check(original, '\n'.join(sentences))
+    except ValueError:
+        check_counts["mismatches"] += 1
+        raise
+
+def verify_batch(originals, outputs):
+    """ Verifies a list of split2() outputs like verify(), but with a single comparison
+        (and a single sampling decision) for the whole list.
+        The non-whitespace characters of each line are joined with newlines on both sides,
+        so a character moved to the output of another line is a mismatch too.
+        Only if it fails, each output is checked to find the mismatch.
+    """
+    if check_policy == CHECK_NEVER \
+    or check_policy == CHECK_SAMPLED and random.random() >= check_rate:
+        check_counts["skipped"] += len(originals)
+        return True
+    check_counts["checked"] += len(originals)
+    if '\n'.join(''.join(original.split()) for original in originals) \
+    == '\n'.join(''.join(''.join(sentences).split()) for sentences in outputs):
+        return True
+    for original, sentences in zip(originals, outputs):
+        try:
+            check(original, '\n'.join(sentences))
+        except ValueError:
+            check_counts["mismatches"] += 1
+            raise
+    return True
     
+#### STREAMING #####################################################################################
+# Corpus preparation tokenizes files of millions of lines; split_stream() and split2_batch() fan
+# the lines out to a pool of processes in chunks, and yield the results in the original order.
+
+def iter_chunks(iterable, size=1000):
+    """ Yields lists of (at most) size consecutive items of the iterable.
+    """
+    chunk = []
+    for x in iterable:
+        chunk.append(x)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _split_chunk(args):
+    splitter, lines, tags = args
+    return [splitter(line, tags=tags) for line in lines]
+
+def map_chunks(function, chunks, processes=None):
+    """ Yields function(chunk) for each chunk in the iterable, in order.
+        With processes > 1 (default: the number of CPUs), the chunks are processed by a pool
+        of processes. At most 2 chunks per process are read ahead, so memory use is
+        bounded however long the input is.
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if processes <= 1:
+        for chunk in chunks:
+            yield function(chunk)
+        return
+    pool = multiprocessing.Pool(processes)
+    try:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(function, (chunk,)))
+            if len(pending) >= 2 * processes:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+        pool.close()
+    finally:
+        # Also stops the workers if the caller stops iterating early.
+        pool.terminate()
+        pool.join()
+
+def split_stream(lines, splitter=split2, tags=True, processes=1, chunksize=1000):
+    """ Yields splitter(line, tags=tags) for each line in the iterable, in order.
+        By default the lines are tokenized in the calling process. With processes > 1
+        (None: the number of CPUs), chunks of chunksize lines are tokenized by a pool
+        of processes, see map_chunks().
+    """
+    chunks = ((splitter, chunk, tags) for chunk in iter_chunks(lines, chunksize))
+    for results in map_chunks(_split_chunk, chunks, processes):
+        for result in results:
+            yield result
+
+def _split2_chunk(args):
+    sentences, tags, replace = args
+    strings, lines = [], []
+    for string in sentences:
+        string, p = _split2(string, tags, replace)
+        strings.append(string)
+        lines.append(p)
+    if tags:
+        verify_batch(strings, lines)
+    return [" ".join(p).split(" ") for p in lines]
+
+def split2_batch(sentences, tags=True, replace=unicode_replacements, processes=1, chunksize=1000):
+    """ Yields the list of tokens of each string in the iterable, i.e. " ".join(split2(string)).split(" ").
+        The strings are tokenized in chunks of chunksize strings, and the output of each chunk
+        is verified with a single check(). By default the chunks are tokenized in the calling
+        process. With processes > 1 (None: the number of CPUs), they are tokenized by a pool
+        of processes, see map_chunks().
+    """
+    chunks = ((chunk, tags, replace) for chunk in iter_chunks(sentences, chunksize))
+    for tokens in map_chunks(_split2_chunk, chunks, processes):
+        for t in tokens:
+            yield t
+
 ######################################################################################################
 
 test1 = u"""
@@ -1002,21 +1457,23 @@ def _usage():
 Tokenizes raw texts.
 
 USAGE
-    python tokenizer.py [-s|-n] txtfile > output
+    python tokenizer.py [-s|-n] [-j processes] txtfile > output
     
 OPTIONS
    -s: Don't split into tokens only split into sentences.
    -n: Don't split into sentences; only split into tokens.
+   -j: Number of tokenizer processes (default: number of CPUs).
    
 REMARKS
-    Assumes UTF8 encoded input    
+    Assumes UTF8 encoded input. Use - as txtfile to read standard input.
+    Empty lines are skipped. The throughput is reported on standard error.
     
 %s (version %s)''' %(__date__, __version__)
 
 
 if __name__ == '__main__':
     try:
-        opts,args=getopt.getopt(sys.argv[1:],'nsh', ['help'])
+        opts,args=getopt.getopt(sys.argv[1:],'nshj:', ['help'])
     except getopt.GetoptError:
         # print help information and exit:
         _usage()
@@ -1024,6 +1481,7 @@ if __name__ == '__main__':
 
     nosentencesplit = False
     notokenisation = False
+    processes = None
 
     for o, a in opts:
         if o in ('-h', '--help'):
@@ -1035,6 +1493,8 @@ if __name__ == '__main__':
         if o in ('-s',):
             # Only split sentences
             notokenisation = True
+        if o in ('-j',):
+            processes = int(a)
             
     if nosentencesplit and notokenisation:
         print >>sys.stderr , 'Error: you can only specify either option -n or option -s'
@@ -1053,14 +1513,19 @@ if __name__ == '__main__':
         splitter = split
 
 
-    f = open(args[0], 'rU')
+    if args[0] == '-':
+        f = sys.stdin
+    else:
+        f = open(args[0], 'rU')
     try:
-        for string in f:
-            string = string.strip()
-        
-            if string:
-                print '\n'.join(splitter(string, tags=True)).encode('utf8')
+        lines = (string.strip() for string in f)
+        lines = (string for string in lines if string)
+        n, t = 0, time.time()
+        for sentences in split_stream(lines, splitter, tags=True, processes=processes):
+            print '\n'.join(sentences).encode('utf8')
+            n += 1
+        t = time.time() - t
+        print >>sys.stderr, '%d lines in %.1fs (%.0f lines/s)' % (n, t, n / max(t, 1e-6))
         
     finally:
         f.close()
-    
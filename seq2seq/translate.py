@@ -43,6 +43,7 @@ import tensorflow as tf
 # from tensorflow.models.rnn.translate import data_utils
 import data_utils
 import seq2seq_model
+import token_ids as token_id_corpus
 from tensorflow.python.platform import gfile
 
 
@@ -93,7 +94,14 @@ def read_data(source_path, target_path, max_size=None):
             (source, target) pairs read from the provided data files that fit
             into the n-th bucket, i.e., such that len(source) < _buckets[n][0] and
             len(target) < _buckets[n][1]; source and target are lists of token-ids.
+            If both files have binary token-ids (see token_ids.py), they are
+            memory-mapped and data_set[n] is a token_ids.Bucket, a sequence that
+            builds the pairs when they are accessed.
   """
+    if token_id_corpus.exists(source_path) and token_id_corpus.exists(target_path):
+        return token_id_corpus.bucket_corpus(token_id_corpus.TokenIdCorpus(source_path),
+                                             token_id_corpus.TokenIdCorpus(target_path),
+                                             _buckets, data_utils.EOS_ID, max_size)
     data_set = [[] for _ in _buckets]
     with gfile.GFile(source_path, mode="r") as source_file:
         with gfile.GFile(target_path, mode="r") as target_file:
@@ -0,0 +1,83 @@
+"""Gunicorn server hooks for the prefork serving mode.
+
+See prefork.ini. The master process binds the listen socket once and forks
+a pool of worker processes, each running its own copy of the Pyramid app,
+so that CPU-bound preprocessing (tokenization, detokenization) scales across
+cores instead of being serialized by the GIL of a single waitress process.
+
+Sending SIGHUP to the master reloads the configuration and gracefully
+replaces the workers with ones running freshly loaded application code
+(the app is deliberately not preloaded in the master for this reason).
+Tunables such as the number of workers live in prefork.ini.
+
+The hooks below log the resident memory of each worker when it starts,
+every MEMORY_REPORT_INTERVAL requests while it serves, and when it exits,
+along with the tokenizer verification counters (see tokenizer_check).
+"""
+import os
+import resource
+import sys
+
+# Report the memory usage of each worker every this many requests.
+MEMORY_REPORT_INTERVAL = 1000
+
+_PAGE_SIZE = resource.getpagesize()
+
+
+def worker_memory():
+    """Return the memory usage of the current process.
+
+    Returns:
+        a tuple (rss, maxrss) where rss is the current resident set size and
+        maxrss is the peak resident set size, both in kilobytes.
+        rss is None on platforms without /proc.
+    """
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        with open('/proc/self/statm') as f:
+            rss = int(f.read().split()[1]) * _PAGE_SIZE // 1024
+    except (IOError, IndexError, ValueError):
+        rss = None
+    return rss, maxrss
+
+
+def report_memory(log, event):
+    """Log the memory usage of the current worker.
+
+    Parameters:
+        log: gunicorn logger to write to.
+        event (string): what triggered the report (e.g., 'started').
+    """
+    rss, maxrss = worker_memory()
+    log.info('worker %d %s: rss=%s KB maxrss=%d KB', os.getpid(), event,
+             rss if rss is not None else 'n/a', maxrss)
+
+
+def report_tokenizer_checks(log):
+    """Log the English tokenizer verification counters of the current worker."""
+    tokenizer = sys.modules.get('web.tokenize_en')
+    if tokenizer is not None:
+        log.info('worker %d tokenizer checks: %s', os.getpid(),
+                 ' '.join('%s=%d' % item for item in sorted(tokenizer.check_counts.items())))
+
+
+def post_fork(server, worker):
+    worker.nr_served = 0
+    report_memory(worker.log, 'started')
+
+
+def post_request(worker, req, environ, resp):
+    worker.nr_served += 1
+    if worker.nr_served % MEMORY_REPORT_INTERVAL == 0:
+        report_memory(worker.log, 'served %d requests' % worker.nr_served)
+        report_tokenizer_checks(worker.log)
+
+
+def worker_exit(server, worker):
+    report_memory(server.log, 'exiting after %d requests' % worker.nr_served)
+    report_tokenizer_checks(server.log)
+
+
+def on_reload(server):
+    server.log.info('master %d reloading: replacing %d workers',
+                    os.getpid(), server.num_workers)
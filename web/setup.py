@@ -15,6 +15,11 @@ requires = [
     'waitress',
     ]
 
+# Optional prefork serving mode (see prefork.ini).
+prefork_requires = [
+    'gunicorn<20',
+    ]
+
 setup(name='web',
       version='0.0',
       description='web',
@@ -33,6 +38,7 @@ setup(name='web',
       include_package_data=True,
       zip_safe=False,
       install_requires=requires,
+      extras_require={'prefork': prefork_requires},
       tests_require=requires,
       test_suite="web",
       entry_points="""\
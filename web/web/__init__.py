@@ -1,92 +1,80 @@
+import os
 import sys
 import re
 from pyramid.config import Configurator
 import xmlrpclib
 import tokenize_en as vva_tokenizer
+import tokenize_jb as jb_tokenizer
 from detokenize import Detokenizer as MTMDetokenizer
+from normalize import sanitize_text, escape_html_entities, unescape_html_entities
+import jobs
+import numerals
+from lexicon import Lexicon
+from translation_memory import TranslationMemory, FuzzyMatcher
 
 
 # Module global Moses server instance - initialized in main() and used in translate().
 MOSES_SERVER = None
 MTMDetok = MTMDetokenizer()
 
-# Maximum length of input source text.
-# Text exceeding this size in length will be truncated.
-MAX_TEXT_LEN = 256
+# Module global job store for asynchronous translation jobs - initialized in main().
+JOB_STORE = None
 
+# Module global single-word best-translation indexes, keyed by direction ('jb2en' or 'en2jb').
+# Initialized in main() and used in translate().
+LEXICONS = {}
 
-def sanitize_text(text):
-    """Sanitize user input by normalizing control characters etc.
+# Module global exact-match translation memories, keyed by direction ('jb2en' or 'en2jb').
+# Initialized in main() and used in translate().
+TRANSLATION_MEMORIES = {}
 
-    Parameters:
-        text (string): text to sanitize.
+# Module global fuzzy matchers over the translation memories, keyed by direction.
+# Initialized in main() and used in fuzzy_match() and translate().
+FUZZY_MATCHERS = {}
 
-    Returns:
-        Sanitized text.
-    """
-    text = text.replace('\t', ' ')
-    text = text.replace('\f', ' ')
-    text = text.replace('\n', ' ')
-    text = text.replace('\r', '')
-    text = text.replace('\x08', '')
-    text = text.replace('\x07', '')
-    text = text.replace('\x1B', '')
-    return text
+# translate() returns the fuzzy match instead of the Moses output when its score
+# is at least this value. None disables this. Initialized in main().
+FUZZY_MATCH_THRESHOLD = None
 
+# translate_with_match() only returns matches scoring at least this value, so that
+# the home page does not show unrelated sentences. Initialized in main().
+FUZZY_MATCH_MIN_SCORE = 0.6
 
-# List of (punctuation, HTML entity) tuples.
-# This is all what Moses's tokenizer.perl script supports.
-PUNC_ENTITY_MAP = [
-    ('&', '&amp;'),
-    ('|', '&#124;'),
-    ('<', '&lt;'),
-    ('>', '&gt;'),
-    ('\'', '&apos;'),
-    ('"', '&quot;'),
-    ('[', '&#91;'),
-    (']', '&#93;')
-]
+# Maximum length of input source text.
+# Text exceeding this size in length will be truncated.
+MAX_TEXT_LEN = 256
 
 
-def escape_html_entities(text):
-    """Replace punctuation marks in text with HTML entities.
+class TranslationError(Exception):
+    """Raised by translate_text() when the Moses server fails to translate a text."""
 
-    Parameters:
-        text (string): text to escape.
 
-    Returns:
-        string with punctuations escaped.
-    """
-    for punc, entity in PUNC_ENTITY_MAP:
-        text = text.replace(punc, entity)
-    return text
-
-
-def unescape_html_entities(text):
-    """Replace HTML entities with punctuation marks.
-    This is the inverse of escape_html_entities() above.
+def tokenize_en(text):
+    """Given an English text, tokenize it using the VVA tokenizer.
 
     Parameters:
-        text (string): text to unescape.
+        text (string): English text to tokenize.
 
     Returns:
-        string with HTML entities unescaped.
+        list of tokenized words (strings)
     """
-    for punc, entity in PUNC_ENTITY_MAP:
-        text = text.replace(entity, punc)
-    return text
+    return next(tokenize_en_batch([text]))
 
 
-def tokenize_en(text):
-    """Given an English text, tokenize it using the VVA tokenizer.
+def tokenize_en_batch(texts):
+    """Tokenize English texts in a batch, see tokenize_en().
 
     Parameters:
-        text (string): English text to tokenize.
+        texts (iterable of strings): English texts (one line each) to tokenize.
 
     Returns:
-        list of tokenized words (strings)
+        generator of lists of tokenized words (strings), one per text.
     """
-    return vva_tokenizer.split2(text)[0].split(' ')
+    return vva_tokenizer.split2_batch(texts)
+
+
+# Single quote directly followed by a non-space, see detokenize_en().
+_QUOTE_WITHOUT_SPACE = re.compile(r'\'([^ ])')
 
 
 def detokenize_en(text):
@@ -101,7 +89,7 @@ def detokenize_en(text):
 
     # Add whitespace after single quotes
     # so that MTMonkey detokenizer can handle contractions properly.
-    text = re.sub(r'\'([^ ])', '\' \\1', text)
+    text = _QUOTE_WITHOUT_SPACE.sub('\' \\1', text)
 
     try:
         text = MTMDetok.detokenize(text)
@@ -116,21 +104,90 @@ def tokenize_jb(text):
 
     # Moses interprets brackets '[]' in a special way, and passing them as is
     # crashes Moses. Tokenize them here.
+    return jb_tokenizer.tokenize(text, brackets=True)
+
+
+def tokenize_jb_batch(texts):
+    """Tokenize Lojban texts in a batch, see tokenize_jb().
 
-    text = text.replace('[', ' [ ')
-    text = text.replace(']', ' ] ')
+    Parameters:
+        texts (iterable of strings): Lojban texts to tokenize.
+
+    Returns:
+        generator of lists of words (strings), one per text.
+    """
+    return jb_tokenizer.tokenize_batch(texts, brackets=True)
 
-    tokens = [word.strip('.?') for word in re.split(' +', text)]
 
-    # remove the first 'i'
-    if len(tokens) > 0 and tokens[0] == 'i':
-        tokens = tokens[1:]
-    return tokens
+def lookup_single_word(tokens, direction):
+    """Look up the translation of a single-token input in the best-translation index.
+
+    Parameters:
+        tokens (list of strings): tokenized source text.
+        direction (string): either 'jb2en' or 'en2jb'.
+
+    Returns:
+        Translation in the same form as Moses's output,
+        or None if the input is not a single word with a confident translation.
+    """
+    if len(tokens) != 1 or direction not in LEXICONS:
+        return None
+    return LEXICONS[direction].lookup(tokens[0])
+
+
+def normalize_source(src, direction, max_len=MAX_TEXT_LEN):
+    """Normalize and tokenize source text the way translate() does.
+
+    Parameters:
+        src (string): text to translate.
+        direction (string): either 'jb2en' or 'en2jb'.
+        max_len (int): length the text is truncated to, or None to keep it whole.
+
+    Returns:
+        list of tokens (strings), before Moses escaping.
+    """
+    if max_len is not None:
+        src = src[:max_len]
+    src = sanitize_text(src)
+    if direction == 'jb2en':
+        return tokenize_jb(src)
+    else:
+        return tokenize_en(src)
+
+
+def fuzzy_match(tokens, direction):
+    """Find the translation memory sentence closest to tokenized source text.
+
+    Parameters:
+        tokens (list of strings): source text normalized by normalize_source().
+        direction (string): either 'jb2en' or 'en2jb'.
+
+    Returns:
+        a tuple (score, source sentence, reference translation) with score in [0, 1],
+        or None if there is no close enough sentence.
+    """
+    if direction not in FUZZY_MATCHERS:
+        return None
+    return FUZZY_MATCHERS[direction].lookup(' '.join(tokens))
+
+
+def lookup_memory(tokens, direction):
+    """Look up tokenized source text in the exact-match translation memory.
+
+    Returns:
+        the reference translation, or None.
+    """
+    if direction not in TRANSLATION_MEMORIES:
+        return None
+    return TRANSLATION_MEMORIES[direction].lookup(' '.join(tokens))
 
 
 def translate(src, direction):
     """Translate source text according to direction.
 
+    The text is truncated to MAX_TEXT_LEN characters, and an empty text is
+    returned if Moses fails.
+
     Parameters:
         src (string): text to translate.
         direction (string): either 'jb2en' or 'en2jb'. Throws AssertionError otherwise.
@@ -138,41 +195,130 @@ def translate(src, direction):
     Returns:
         Translated text.
     """
+    return translate_with_match(src, direction)[0]
 
-    src = src[:MAX_TEXT_LEN]
-    src = sanitize_text(src)
 
+def translate_with_match(src, direction):
+    """Translate source text as translate() does, and find the closest
+    translation memory sentence to show next to the output.
+
+    Parameters:
+        src (string): text to translate.
+        direction (string): either 'jb2en' or 'en2jb'. Throws AssertionError otherwise.
+
+    Returns:
+        a tuple (translated text, match) where match is a tuple (score, source
+        sentence, reference translation) with score in [FUZZY_MATCH_MIN_SCORE, 1],
+        or None if there is no such sentence or the text was answered by the
+        numeral rules or the exact-match translation memory.
+    """
+    try:
+        return _translate(src, direction, MAX_TEXT_LEN, True)
+    except TranslationError:
+        return '', None
+
+
+def translate_text(src, direction, max_len=None):
+    """Translate source text according to direction, see translate().
+
+    Unlike translate(), the text is not truncated by default, and Moses errors
+    are raised, so that asynchronous jobs fail instead of returning blank lines.
+
+    Parameters:
+        src (string): text to translate.
+        direction (string): either 'jb2en' or 'en2jb'. Throws AssertionError otherwise.
+        max_len (int): length the text is truncated to, or None to keep it whole.
+
+    Returns:
+        Translated text.
+
+    Raises:
+        TranslationError: if the Moses server fails.
+    """
+    return _translate(src, direction, max_len, False)[0]
+
+
+def _translate(src, direction, max_len, with_match):
+    """Translate source text; see translate_with_match() and translate_text().
+
+    The fuzzy match is only looked up if it is to be returned (with_match) or
+    FUZZY_MATCH_THRESHOLD is set, and never after a numeral or exact hit.
+    """
+    assert direction in ['jb2en', 'en2jb']
+    tokens = normalize_source(src, direction, max_len)
     if direction == 'jb2en':
+        number = numerals.jb_to_en(tokens)
+    else:
+        number = numerals.en_to_jb(tokens)
+    if number is not None:
+        return number, None
+    ref = lookup_memory(tokens, direction)
+    if ref is not None:
+        return ref, None
+
+    match = None
+    if with_match or FUZZY_MATCH_THRESHOLD is not None:
+        match = fuzzy_match(tokens, direction)
+    if match is not None and FUZZY_MATCH_THRESHOLD is not None and match[0] >= FUZZY_MATCH_THRESHOLD:
+        tgt = match[2]
+    elif direction == 'jb2en':
         # Lojban to English translation
-        src = ' '.join(tokenize_jb(src))
-        try:
-            tgt = MOSES_SERVER.translate_jb2en(src)
-        except Exception as e:
-            return ''
+        tgt = lookup_single_word(tokens, direction)
+        if tgt is None:
+            try:
+                tgt = MOSES_SERVER.translate_jb2en(' '.join(tokens))
+            except Exception as e:
+                raise TranslationError(e)
         tgt = unescape_html_entities(tgt)
         tgt = detokenize_en(tgt)
-        return tgt
-    elif direction == 'en2jb':
+    else:
         # English to Lojban translation
-        src = ' '.join(tokenize_en(src))
-        src = escape_html_entities(src)
-        try:
-            tgt = MOSES_SERVER.translate_en2jb(src)
-        except Exception as e:
-            return ''
+        tokens = [escape_html_entities(token) for token in tokens]
+        tgt = lookup_single_word(tokens, direction)
+        if tgt is None:
+            try:
+                tgt = MOSES_SERVER.translate_en2jb(' '.join(tokens))
+            except Exception as e:
+                raise TranslationError(e)
         tgt = unescape_html_entities(tgt)
-        return tgt
-    else:
-        assert False
+
+    if not with_match or match is None or match[0] < FUZZY_MATCH_MIN_SCORE:
+        match = None
+    return tgt, match
 
 
 def main(global_config, **settings):
-    global MOSES_SERVER
+    global MOSES_SERVER, JOB_STORE, FUZZY_MATCH_THRESHOLD, FUZZY_MATCH_MIN_SCORE
     """This function returns a Pyramid WSGI application."""
     config = Configurator(settings=settings)
     config.include('pyramid_chameleon')
     config.add_static_view('static', 'static', cache_max_age=3600)
     config.add_route('home', '/')
+    config.add_route('job_submit', '/jobs', request_method='POST')
+    config.add_route('job_status', '/jobs/{id}')
+    config.add_route('job_result', '/jobs/{id}/result')
     config.scan()
     MOSES_SERVER = xmlrpclib.ServerProxy(settings['moses_server'])
+    for direction in ['jb2en', 'en2jb']:
+        path = settings.get('lexicon_' + direction)
+        if path and os.path.exists(path):
+            LEXICONS[direction] = Lexicon(path)
+        elif path:
+            print >>sys.stderr, 'Lexicon %s not found; single-word fast path disabled.' % path
+        path = settings.get('translation_memory_' + direction)
+        if path and os.path.exists(path):
+            TRANSLATION_MEMORIES[direction] = TranslationMemory(path)
+            FUZZY_MATCHERS[direction] = FuzzyMatcher(TRANSLATION_MEMORIES[direction])
+        elif path:
+            print >>sys.stderr, 'Translation memory %s not found; exact and fuzzy matching disabled.' % path
+    vva_tokenizer.set_check_policy(settings.get('tokenizer_check', vva_tokenizer.CHECK_SAMPLED),
+                                   settings.get('tokenizer_check_rate'))
+    if settings.get('fuzzy_match_threshold'):
+        FUZZY_MATCH_THRESHOLD = float(settings['fuzzy_match_threshold'])
+    if settings.get('fuzzy_match_min_score'):
+        FUZZY_MATCH_MIN_SCORE = float(settings['fuzzy_match_min_score'])
+    if 'job_store' in settings:
+        JOB_STORE = jobs.JobStore(settings['job_store'],
+                                  int(settings.get('job_max_per_client', jobs.MAX_JOBS_PER_CLIENT)))
+        jobs.start_workers(JOB_STORE, translate_text, int(settings.get('job_workers', 2)))
     return config.make_wsgi_app()
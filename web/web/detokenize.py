@@ -6,21 +6,38 @@ A simple de-tokenizer for MT post-processing.
 
 Library usage:
 
+    from detokenize import Detokenizer
+    detok = Detokenizer({'language': 'en', 'moses_deescape': True})
+    text = detok.detokenize('Hello , world !')
+    texts = detok.detokenize_batch(lines, processes=4)  # generator, in order
+
+    incremental = IncrementalDetokenizer(detok)
+    for token in tokens:
+        display(incremental.add(token))  # text finalized so far
+    display(incremental.flush())
+
 Command-line usage:
 
-    ./detokenize.py [-c] [-l LANG] [-e ENCODING] [input-file output-file]
+    ./detokenize.py [-c] [-m] [-l LANG] [-e ENCODING] [-j PROCESSES] [input-file output-file]
 
     -e = use the given encoding (default: UTF-8)
     -l = use rules for the given language (ISO-639-2 code, default: en)
     -c = capitalize the first words of sentences
+    -m = de-escape special characters of Moses
+    -j = number of de-tokenizer processes (default: number of CPUs)
 
     If no input and output files are given, the de-tokenizer will read
-    STDIN and write to STDOUT.
+    STDIN and write to STDOUT. Lines are de-tokenized in chunks by a pool of
+    processes and written in the input order, in constant memory.
 """
 
 from __future__ import unicode_literals
 from regex import Regex, IGNORECASE
+import codecs
+import getopt
 import sys
+from normalize import Replacer
+from parallel import iter_chunks, map_chunks
 
 
 __author__ = "Ondřej Dušek"
@@ -40,7 +57,8 @@ class Detokenizer(object):
                ('&gt;', '>'),
                ('&bra;', '['),
                ('&ket;', ']'),
-               ('&amp;', '&')]  # should go last to prevent double de-escaping
+               ('&amp;', '&')]
+    DEESCAPE = Replacer(ESCAPES)  # all in one pass, so the order does not matter
 
     # Contractions for different languages
     CONTRACTIONS = {'en': r'^\p{Alpha}+(\'(ll|ve|re|[dsm])|n\'t)$',
@@ -49,11 +67,21 @@ class Detokenizer(object):
                     'it': r'^\p{Alpha}*(l\'\p{Alpha}+|[cv]\'è)$',
                     'cs': r'^\p{Alpha}+[-–](mail|li)$', }
 
+    # Token kinds, see _token_class()
+    CURRENCY_OR_INIT_PUNCT = 1
+    NOPRESPACE_PUNCT = 2
+    CONTRACTION_MARK = 3
+    WORD = 4
+
+    # Maximum number of memoized token classes
+    MAX_CACHED_TOKENS = 100000
+
     def __init__(self, options={}):
         """\
         Constructor (pre-compile all needed regexes).
         """
         # process options
+        self.options = dict(options)
         self.moses_deescape = True if options.get('moses_deescape') else False
         self.language = options.get('language', 'en')
         self.capitalize_sents = True if options.get('capitalize_sents') else False
@@ -70,6 +98,9 @@ class Detokenizer(object):
         if self.language in self.CONTRACTIONS:
             self.__contract = Regex(self.CONTRACTIONS[self.language],
                                     IGNORECASE)
+        # memoized token classes and CJK characters
+        self.__classes = {}
+        self.__cjk = {}
 
     def detokenize(self, text):
         """\
@@ -78,78 +109,312 @@ class Detokenizer(object):
         # split text
         words = text.split(' ')
         # paste text back, omitting spaces where needed
-        text = ''
+        out = []
+        last = ''  # last character of the text so far
         pre_spc = ' '
         quote_count = {'\'': 0, '"': 0, '`': 0}
         for pos, word in enumerate(words):
-            # remove spaces in between CJK chars
-            if self.__cjk_chars.match(text[-1:]) and \
-                    self.__cjk_chars.match(word[:1]):
-                text += word
+            cjk_start, kind, quote = self._token_class(word)
+            # shortcut for normal words, see _paste()
+            if kind == self.WORD and not quote and not cjk_start:
+                piece = pre_spc + word
                 pre_spc = ' '
-            # no space after currency and initial punctuation
-            elif self.__currency_or_init_punct.match(word):
-                text += pre_spc + word
-                pre_spc = ''
-            # no space before commas etc. (exclude some punctuation for French)
-            elif self.__noprespace_punct.match(word) and \
-                    (self.language != 'fr' or not
-                     self.__fr_prespace_punct.match(word)):
-                text += word
-                pre_spc = ' '
-            # contractions with comma or hyphen
-            elif word in "'-–" and pos > 0 and pos < len(words) - 1 \
-                    and self.__contract is not None \
-                    and self.__contract.match(''.join(words[pos - 1:pos + 2])):
-                text += word
-                pre_spc = ''
-            # handle quoting
-            elif word in '\'"„“”‚‘’`':
-                # detect opening and closing quotes by counting
-                # the appropriate quote types
-                quote_type = word
-                if quote_type in '„“”':
-                    quote_type = '"'
-                elif quote_type in '‚‘’':
-                    quote_type = '\''
-                # exceptions for true Unicode quotes in Czech & German
-                if self.language in ['cs', 'de'] and word in '„‚':
-                    quote_count[quote_type] = 0
-                elif self.language in ['cs', 'de'] and word in '“‘':
-                    quote_count[quote_type] = 1
-                # special case: possessives in English ("Jones'" etc.)
-                if self.language == 'en' and text.endswith('s'):
-                    text += word
-                    pre_spc = ' '
-                # really a quotation mark
-                else:
-                    # opening quote
-                    if quote_count[quote_type] % 2 == 0:
-                        text += pre_spc + word
-                        pre_spc = ''
-                    # closing quote
-                    else:
-                        text += word
-                        pre_spc = ' '
-                    quote_count[quote_type] += 1
-            # keep spaces around normal words
             else:
-                text += pre_spc + word
-                pre_spc = ' '
+                piece, pre_spc = self._paste(word, words[pos - 1] if pos > 0 else None,
+                                             words[pos + 1] if pos < len(words) - 1 else None,
+                                             last, pre_spc, quote_count)
+            if piece:
+                out.append(piece)
+                last = piece[-1]
+        text = ''.join(out)
         # de-escape chars that are special to Moses
         if self.moses_deescape:
-            for char, repl in self.ESCAPES:
-                text = text.replace(char, repl)
+            text = self._deescape(text)
         # strip leading/trailing space
         text = text.strip()
         # capitalize, if the sentence ends with a final punctuation
-        if self.capitalize_sents and self.__final_punct.search(text):
+        if self.capitalize_sents:
+            text = self._capitalize(text)
+        return text
+
+    def _deescape(self, text):
+        """\
+        De-escape the characters that are special to Moses.
+        """
+        return self.DEESCAPE(text)
+
+    def _capitalize(self, text):
+        """\
+        Capitalize the (whole) text if it ends with a final punctuation.
+        """
+        if self.__final_punct.search(text):
             text = text[0].upper() + text[1:]
         return text
 
+    def _paste(self, word, prev, next, last, pre_spc, quote_count):
+        """\
+        Decide how to paste the given word to the text so far.
+
+        prev and next are the neighbouring words (None at the start or end
+        of the text), last is the last character of the text so far,
+        pre_spc the space to put before the word unless it is attached to
+        the preceding text; quote_count is updated for quotation marks.
+        Returns the piece of text to append and the new pre_spc.
+        """
+        cjk_start, kind, quote = self._token_class(word)
+        # remove spaces in between CJK chars
+        if cjk_start and self.__is_cjk(last):
+            piece = word
+            pre_spc = ' '
+        # no space after currency and initial punctuation
+        elif kind == self.CURRENCY_OR_INIT_PUNCT:
+            piece = pre_spc + word
+            pre_spc = ''
+        # no space before commas etc. (exclude some punctuation for French)
+        elif kind == self.NOPRESPACE_PUNCT:
+            piece = word
+            pre_spc = ' '
+        # contractions with comma or hyphen
+        elif kind == self.CONTRACTION_MARK and prev is not None \
+                and next is not None and self.__contract is not None \
+                and self.__contract.match(prev + word + next):
+            piece = word
+            pre_spc = ''
+        # handle quoting
+        elif quote:
+            # detect opening and closing quotes by counting
+            # the appropriate quote types
+            quote_type = word
+            if quote_type in '„“”':
+                quote_type = '"'
+            elif quote_type in '‚‘’':
+                quote_type = '\''
+            # exceptions for true Unicode quotes in Czech & German
+            if self.language in ['cs', 'de'] and word in '„‚':
+                quote_count[quote_type] = 0
+            elif self.language in ['cs', 'de'] and word in '“‘':
+                quote_count[quote_type] = 1
+            # special case: possessives in English ("Jones'" etc.)
+            if self.language == 'en' and last == 's':
+                piece = word
+                pre_spc = ' '
+            # really a quotation mark
+            else:
+                # opening quote
+                if quote_count[quote_type] % 2 == 0:
+                    piece = pre_spc + word
+                    pre_spc = ''
+                # closing quote
+                else:
+                    piece = word
+                    pre_spc = ' '
+                quote_count[quote_type] += 1
+        # keep spaces around normal words
+        else:
+            piece = pre_spc + word
+            pre_spc = ' '
+        return piece, pre_spc
+
+    def detokenize_batch(self, texts, processes=1, chunksize=1000):
+        """\
+        Detokenize each text of the given iterable, yielding the results
+        in order. With processes > 1 (None = number of CPUs), chunks of
+        chunksize texts are detokenized by a pool of processes, see
+        parallel.map_chunks().
+        """
+        if processes is not None and processes <= 1:
+            for text in texts:
+                yield self.detokenize(text)
+            return
+        chunks = ((self.options, chunk) for chunk in iter_chunks(texts, chunksize))
+        for results in map_chunks(_detokenize_chunk, chunks, processes):
+            for text in results:
+                yield text
+
+    def _token_class(self, word):
+        """\
+        Return the (memoized) class of the given token: a tuple of
+        (starts with a CJK character?, kind, is a quotation mark?), where
+        kind is the first of the token kinds tested by detokenize() that
+        applies to the token.
+        """
+        cls = self.__classes.get(word)
+        if cls is None:
+            if self.__currency_or_init_punct.match(word):
+                kind = self.CURRENCY_OR_INIT_PUNCT
+            elif self.__noprespace_punct.match(word) and \
+                    (self.language != 'fr' or not
+                     self.__fr_prespace_punct.match(word)):
+                kind = self.NOPRESPACE_PUNCT
+            elif word in "'-–":
+                kind = self.CONTRACTION_MARK
+            else:
+                kind = self.WORD
+            cls = (self.__is_cjk(word[:1]), kind, word in '\'"„“”‚‘’`')
+            if len(self.__classes) >= self.MAX_CACHED_TOKENS:
+                self.__classes.clear()
+            self.__classes[word] = cls
+        return cls
+
+    def __is_cjk(self, char):
+        """\
+        Return True if the given character is a CJK character (memoized).
+        """
+        cjk = self.__cjk.get(char)
+        if cjk is None:
+            cjk = self.__cjk[char] = self.__cjk_chars.match(char) is not None
+        return cjk
+
+
+class IncrementalDetokenizer(object):
+    """\
+    De-tokenizer for streamed output: takes the tokens of a text one at a
+    time and returns the text that is final as soon as possible.
+
+    The concatenation of all the strings returned by add() and flush() is
+    Detokenizer.detokenize() of the space-separated tokens. Text is held
+    back only where the rules need it: a contraction mark (' - –) until
+    the next token, trailing spaces, a possibly incomplete Moses escape,
+    and, with capitalize_sents, the whole text (its first letter depends
+    on its final punctuation).
+    """
+
+    def __init__(self, detokenizer):
+        """\
+        Constructor, using the rules and settings of the given Detokenizer.
+        """
+        self.detokenizer = detokenizer
+        self.reset()
+
+    def reset(self):
+        """\
+        Start a new text.
+        """
+        self.prev = None  # previous token
+        self.pending = None  # contraction mark waiting for the next token
+        self.last = ''  # last character of the pasted text
+        self.pre_spc = ' '
+        self.quote_count = {'\'': 0, '"': 0, '`': 0}
+        self.buffer = ''  # pasted text not returned yet
+        self.started = False  # has any (non-space) text been returned?
+
+    def add(self, token):
+        """\
+        Add the next token (several if it contains spaces) and return the
+        newly finalized text.
+        """
+        for word in token.split(' '):
+            if self.pending is not None:
+                self.__paste(self.pending, word)
+                self.pending = None
+            if self.detokenizer._token_class(word)[1] == Detokenizer.CONTRACTION_MARK:
+                self.pending = word
+            else:
+                self.__paste(word, None)
+        return self.__emit(final=False)
+
+    def flush(self):
+        """\
+        Finish the text, return the rest of it, and start a new text.
+        """
+        if self.pending is not None:
+            self.__paste(self.pending, None)
+            self.pending = None
+        text = self.__emit(final=True)
+        self.reset()
+        return text
+
+    def __paste(self, word, next):
+        piece, self.pre_spc = self.detokenizer._paste(word, self.prev, next, self.last,
+                                                      self.pre_spc, self.quote_count)
+        self.prev = word
+        if piece:
+            self.buffer += piece
+            self.last = piece[-1]
+
+    def __emit(self, final):
+        detok = self.detokenizer
+        text = self.buffer
+        if not self.started:
+            text = text.lstrip()
+        cut = len(text.rstrip())
+        if not final:
+            if detok.capitalize_sents:
+                cut = 0
+            elif detok.moses_deescape:
+                # an escape (at most 5 characters long) may continue in the next token
+                amp = text.find('&', max(0, cut - 4), cut)
+                if amp >= 0:
+                    cut = amp
+        out, self.buffer = text[:cut], text[cut:]
+        if out:
+            self.started = True
+        if detok.moses_deescape:
+            out = detok._deescape(out)
+        if final and detok.capitalize_sents:
+            out = detok._capitalize(out)
+        return out
+
+
+# De-tokenizers of the current (worker) process, by options
+_DETOKENIZERS = {}
+
+
+def _detokenize_chunk(args):
+    """\
+    Detokenize a chunk of texts in a worker process of detokenize_batch().
+    """
+    options, texts = args
+    key = tuple(sorted(options.items()))
+    if key not in _DETOKENIZERS:
+        _DETOKENIZERS[key] = Detokenizer(options)
+    return [_DETOKENIZERS[key].detokenize(text) for text in texts]
+
 
 def display_usage():
     """\
     Display program usage information.
     """
     print >> sys.stderr, __doc__
+
+
+def main():
+    """\
+    Main function: de-tokenize the input file (or STDIN) line by line.
+    """
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'cme:l:j:h', ['help'])
+    except getopt.GetoptError:
+        display_usage()
+        sys.exit(2)
+    options = {}
+    encoding = DEFAULT_ENCODING
+    processes = None
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            display_usage()
+            sys.exit()
+        elif opt == '-c':
+            options['capitalize_sents'] = True
+        elif opt == '-m':
+            options['moses_deescape'] = True
+        elif opt == '-l':
+            options['language'] = arg
+        elif opt == '-e':
+            encoding = arg
+        elif opt == '-j':
+            processes = int(arg)
+    if len(args) not in (0, 2):
+        display_usage()
+        sys.exit(1)
+    fh_in = open(args[0], 'rb') if args else sys.stdin
+    fh_out = codecs.getwriter(encoding)(open(args[1], 'wb') if args else sys.stdout)
+    # decode line by line: a codecs reader would also split on Unicode line separators
+    lines = (line.decode(encoding).rstrip('\r\n') for line in fh_in)
+    for text in Detokenizer(options).detokenize_batch(lines, processes):
+        fh_out.write(text + '\n')
+    fh_out.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+"""Asynchronous translation jobs for large inputs (documents, glossaries).
+
+A job is submitted with the whole text, translated line by line by
+background worker threads, and polled / fetched by the client later, so that
+long translations do not hold an HTTP request (and a server thread) open.
+
+Jobs are kept in a local SQLite database, so they survive restarts and are
+shared by all the processes of the prefork serving mode (see prefork.ini);
+each process runs its own workers, which claim queued jobs atomically.
+"""
+import sqlite3
+import threading
+import time
+import uuid
+
+# Job states.
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Maximum length of the source text of a single job; longer texts are refused.
+MAX_JOB_TEXT_LEN = 1024 * 1024
+
+# Maximum number of queued or running jobs per client.
+MAX_JOBS_PER_CLIENT = 2
+
+# A running job not updated for this many seconds is assumed to be orphaned
+# (e.g. its process was killed) and is handed to another worker.
+STALE_JOB_TIMEOUT = 600
+
+# Finished jobs are deleted after this many seconds.
+JOB_TTL = 7 * 24 * 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    client TEXT NOT NULL,
+    direction TEXT NOT NULL,
+    state TEXT NOT NULL,
+    src TEXT NOT NULL,
+    tgt TEXT,
+    done INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created);
+CREATE INDEX IF NOT EXISTS jobs_client ON jobs (client, state);
+"""
+
+
+class TooManyJobs(Exception):
+    """Raised when a client already has MAX_JOBS_PER_CLIENT unfinished jobs."""
+
+
+class JobStore(object):
+    """Persistent job queue backed by a SQLite database file."""
+
+    def __init__(self, path, max_jobs_per_client=MAX_JOBS_PER_CLIENT):
+        self.path = path
+        self.max_jobs_per_client = max_jobs_per_client
+        conn = self._connect()
+        try:
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        # One connection per call: connections cannot be shared across threads.
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def submit(self, client, direction, src):
+        """Queue a new job.
+
+        Parameters:
+            client (string): identifier of the submitting client (e.g., IP address).
+            direction (string): either 'jb2en' or 'en2jb'.
+            src (string): text to translate, one segment per line.
+
+        Returns:
+            the id (string) of the new job.
+
+        Raises:
+            TooManyJobs: if the client already has too many unfinished jobs.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            (active,) = conn.execute(
+                'SELECT COUNT(*) FROM jobs WHERE client = ? AND state IN (?, ?)',
+                (client, QUEUED, RUNNING)).fetchone()
+            if active >= self.max_jobs_per_client:
+                conn.execute('ROLLBACK')
+                raise TooManyJobs(client)
+            conn.execute(
+                'INSERT INTO jobs VALUES (?, ?, ?, ?, ?, NULL, 0, ?, ?, ?)',
+                (job_id, client, direction, QUEUED, src,
+                 len(src.split('\n')), now, now))
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        return job_id
+
+    def get(self, job_id):
+        """Return the job with the given id as a dict, or None if there is no such job."""
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return dict(row) if row is not None else None
+
+    def claim(self):
+        """Atomically take the oldest queued (or orphaned) job and mark it as running.
+
+        Returns:
+            the claimed job as a dict, or None if there is nothing to do.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                'SELECT * FROM jobs WHERE state = ? OR (state = ? AND updated < ?) '
+                'ORDER BY created LIMIT 1',
+                (QUEUED, RUNNING, now - STALE_JOB_TIMEOUT)).fetchone()
+            if row is not None:
+                conn.execute('UPDATE jobs SET state = ?, done = 0, updated = ? WHERE id = ?',
+                             (RUNNING, now, row['id']))
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        job = dict(row)
+        job['state'] = RUNNING
+        return job
+
+    def update(self, job_id, state, done, tgt=None):
+        """Record the progress (and, when finished, the result) of a job."""
+        conn = self._connect()
+        try:
+            conn.execute('UPDATE jobs SET state = ?, done = ?, tgt = ?, updated = ? WHERE id = ?',
+                         (state, done, tgt, time.time(), job_id))
+        finally:
+            conn.close()
+
+    def purge(self, ttl=JOB_TTL):
+        """Delete finished jobs older than ttl seconds."""
+        conn = self._connect()
+        try:
+            conn.execute('DELETE FROM jobs WHERE state IN (?, ?) AND updated < ?',
+                         (DONE, FAILED, time.time() - ttl))
+        finally:
+            conn.close()
+
+
+class JobWorker(threading.Thread):
+    """Background thread that translates queued jobs line by line."""
+
+    # Seconds to sleep when there is no queued job.
+    POLL_INTERVAL = 1.0
+
+    # Write progress back to the store every this many lines.
+    PROGRESS_INTERVAL = 20
+
+    def __init__(self, store, translate):
+        """
+        Parameters:
+            store (JobStore): the job queue.
+            translate (callable): translate(src, direction) returning the translated text
+                of a whole line (see web.translate_text()). It must raise an
+                exception when the line cannot be translated, which fails the job.
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.store = store
+        self.translate = translate
+
+    def run(self):
+        while True:
+            job = self.store.claim()
+            if job is None:
+                self.store.purge()
+                time.sleep(self.POLL_INTERVAL)
+                continue
+            self.process(job)
+
+    def process(self, job):
+        """Translate a claimed job and store its result."""
+        tgt_lines = []
+        try:
+            for i, line in enumerate(job['src'].split('\n')):
+                tgt_lines.append(self.translate(line, job['direction']) if line.strip() else line)
+                if (i + 1) % self.PROGRESS_INTERVAL == 0:
+                    self.store.update(job['id'], RUNNING, i + 1)
+        except Exception:
+            self.store.update(job['id'], FAILED, len(tgt_lines))
+            return
+        self.store.update(job['id'], DONE, len(tgt_lines), '\n'.join(tgt_lines))
+
+
+def start_workers(store, translate, num_workers):
+    """Start num_workers JobWorker threads and return them."""
+    workers = [JobWorker(store, translate) for _ in range(num_workers)]
+    for worker in workers:
+        worker.start()
+    return workers
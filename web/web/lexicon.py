@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+"""Single-word translation fast path.
+
+Single dictionary words ("apple", "pa", "coi") make up a large share of the
+queries, and do not need a full Moses search with LM and reordering when the
+translation model is already confident about them. This module builds,
+offline, an index of the best translation of every such word from the Moses
+model files, and answers lookups from it by binary search over a memory-mapped
+file.
+
+Candidates are the phrase-table entries whose source side is a single word,
+ranked by the direct phrase translation probability p(e|f). An entry is kept
+only if p(e|f) >= MIN_PROB and it was extracted at least MIN_COUNT times.
+Words without a confident phrase-table entry are also kept when the lexical
+translation tables (lex.f2e / lex.e2f) agree, in both directions, with
+probability >= MIN_LEX_PROB. All other words fall back to Moses.
+
+Index file format (all integers are little-endian uint32):
+
+    MAGIC, N, offsets[2 * N + 1], then the N keys and N values back to back
+
+where key i (UTF-8) is at [offsets[i], offsets[N + i]), value i is at
+[offsets[N + i], offsets[N + i + 1]) and keys are sorted bytewise. Values
+are target phrases as they come out of Moses (tokenized and escaped).
+
+Command-line usage:
+
+    python lexicon.py MODEL_DIR OUTPUT_FILE
+
+    e.g. python lexicon.py train.jb-en/model train.jb-en/model/best-translation.bin
+"""
+import argparse
+import gzip
+import mmap
+import os
+import struct
+
+MAGIC = b'ZMFLEX1\n'
+
+# Minimum direct phrase translation probability p(e|f) of a confident entry.
+MIN_PROB = 0.5
+
+# Minimum number of times a confident phrase pair was extracted from the corpus.
+MIN_COUNT = 2
+
+# Minimum lexical translation probability, in both directions, of a confident
+# word pair taken from the lexical tables.
+MIN_LEX_PROB = 0.5
+
+_UINT32 = struct.Struct('<I')
+
+
+def read_phrase_table(path, min_prob=MIN_PROB, min_count=MIN_COUNT):
+    """Read the confident single-word entries of a Moses phrase table.
+
+    Args:
+        path: path to phrase-table.gz.
+        min_prob: minimum direct phrase translation probability p(e|f).
+        min_count: minimum joint count of the phrase pair.
+
+    Returns:
+        a dict mapping a source word (bytes) to a tuple (p(e|f), target phrase).
+    """
+    best = {}
+    with gzip.open(path, 'rb') as f:
+        for line in f:
+            fields = line.split(b' ||| ')
+            src = fields[0]
+            if b' ' in src:
+                continue
+            scores = fields[2].split()
+            prob = float(scores[2])
+            counts = fields[4].split()
+            if prob < min_prob or len(counts) < 3 or float(counts[2]) < min_count:
+                continue
+            if src not in best or prob > best[src][0]:
+                best[src] = (prob, fields[1].strip())
+    return best
+
+
+def read_lex_tables(f2e_path, e2f_path, min_prob=MIN_LEX_PROB):
+    """Read the word pairs the lexical translation tables agree on in both directions.
+
+    Args:
+        f2e_path: path to lex.f2e, lines of "target source p(target|source)".
+        e2f_path: path to lex.e2f, lines of "source target p(source|target)".
+        min_prob: minimum probability in both directions.
+
+    Returns:
+        a dict mapping a source word (bytes) to a tuple (p(e|f), target word).
+    """
+    best = {}
+    with open(f2e_path, 'rb') as f:
+        for line in f:
+            tgt, src, prob = line.split()
+            prob = float(prob)
+            if prob >= min_prob and (src not in best or prob > best[src][0]):
+                best[src] = (prob, tgt)
+    agreed = {}
+    with open(e2f_path, 'rb') as f:
+        for line in f:
+            src, tgt, prob = line.split()
+            if src in best and best[src][1] == tgt and float(prob) >= min_prob:
+                agreed[src] = best[src]
+    return agreed
+
+
+def build_lexicon(model_dir, output_path, min_prob=MIN_PROB, min_count=MIN_COUNT,
+                  min_lex_prob=MIN_LEX_PROB):
+    """Build the best-translation index of a Moses model directory.
+
+    Args:
+        model_dir: directory containing phrase-table.gz, lex.f2e and lex.e2f.
+        output_path: path of the index file to write.
+
+    Returns:
+        the number of words in the index.
+    """
+    entries = read_lex_tables(os.path.join(model_dir, 'lex.f2e'),
+                              os.path.join(model_dir, 'lex.e2f'), min_lex_prob)
+    # Phrase-table entries take precedence over the lexical tables.
+    entries.update(read_phrase_table(os.path.join(model_dir, 'phrase-table.gz'),
+                                     min_prob, min_count))
+    keys = sorted(entries)
+    values = [entries[k][1] for k in keys]
+
+    offsets = []
+    pos = 0
+    for item in keys + values:
+        offsets.append(pos)
+        pos += len(item)
+    offsets.append(pos)
+
+    with open(output_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(_UINT32.pack(len(keys)))
+        f.write(struct.pack('<%dI' % len(offsets), *offsets))
+        for item in keys + values:
+            f.write(item)
+    return len(keys)
+
+
+class Lexicon(object):
+    """Read-only, memory-mapped best-translation index built by build_lexicon()."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError('%s is not a lexicon index file' % path)
+        self._n = _UINT32.unpack_from(self._mm, len(MAGIC))[0]
+        self._offsets = len(MAGIC) + _UINT32.size
+        self._data = self._offsets + _UINT32.size * (2 * self._n + 1)
+
+    def __len__(self):
+        return self._n
+
+    def _item(self, i):
+        start, end = struct.unpack_from('<II', self._mm, self._offsets + _UINT32.size * i)
+        return self._mm[self._data + start:self._data + end]
+
+    def lookup(self, word):
+        """Return the best translation (unicode) of word, or None if there is no confident one."""
+        key = word.encode('utf-8')
+        lo, hi = 0, self._n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._item(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._n and self._item(lo) == key:
+            return self._item(self._n + lo).decode('utf-8')
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build a single-word best-translation index.')
+    parser.add_argument('model_dir', help='Moses model directory (e.g. train.jb-en/model)')
+    parser.add_argument('output', help='index file to write')
+    parser.add_argument('--min-prob', type=float, default=MIN_PROB)
+    parser.add_argument('--min-count', type=float, default=MIN_COUNT)
+    parser.add_argument('--min-lex-prob', type=float, default=MIN_LEX_PROB)
+    args = parser.parse_args()
+    n = build_lexicon(args.model_dir, args.output, args.min_prob, args.min_count,
+                      args.min_lex_prob)
+    print '%d words written to %s' % (n, args.output)
+
+
+if __name__ == '__main__':
+    main()
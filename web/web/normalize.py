@@ -0,0 +1,172 @@
+"""Character-level normalization of the text around the tokenizers and Moses.
+
+sanitize_text() cleans user input before it is tokenized, and
+escape_html_entities() / unescape_html_entities() convert the characters that
+are special to Moses to and from the entities it expects. Replacer is the
+one-pass multi-string replacement they are built on; the detokenizer uses it
+for its own Moses de-escaping table (Detokenizer.ESCAPES).
+
+Benchmark against the sequential str.replace() passes it replaced:
+
+    python normalize.py [FILE]
+
+where FILE (default: STDIN) is a sample of text, one sentence per line.
+"""
+import re
+import sys
+import timeit
+
+
+class Replacer(object):
+    """Replace several substrings in a single pass over the text.
+
+    The text is scanned once by a compiled alternation of all the substrings
+    (longest first), and each match is looked up in a dict, so a replacement
+    is never itself replaced again. Texts containing none of the first
+    characters of the substrings (most of them) are returned after a few
+    substring tests, which are much cheaper than a regex scan.
+    """
+
+    def __init__(self, pairs):
+        """
+        Parameters:
+            pairs (list of (string, string) tuples): (old, new) replacements.
+        """
+        self.table = dict(pairs)
+        olds = sorted(self.table, key=len, reverse=True)
+        if all(len(old) == 1 for old in olds):
+            self.pattern = re.compile('[%s]' % ''.join(re.escape(old) for old in olds))
+        else:
+            self.pattern = re.compile('|'.join(re.escape(old) for old in olds))
+        self.firsts = sorted(set(old[0] for old in olds))
+        table = self.table
+        self._repl = lambda m: table[m.group()]
+
+    def __call__(self, text):
+        for char in self.firsts:
+            if char in text:
+                return self.pattern.sub(self._repl, text)
+        return text
+
+
+# Control characters in user input: tabs, newlines and form feeds
+# become spaces, the others are removed.
+CONTROL_CHAR_MAP = [
+    ('\t', ' '),
+    ('\f', ' '),
+    ('\n', ' '),
+    ('\r', ''),
+    ('\x08', ''),
+    ('\x07', ''),
+    ('\x1B', '')
+]
+
+# List of (punctuation, HTML entity) tuples.
+# This is all what Moses's tokenizer.perl script supports.
+PUNC_ENTITY_MAP = [
+    ('&', '&amp;'),
+    ('|', '&#124;'),
+    ('<', '&lt;'),
+    ('>', '&gt;'),
+    ('\'', '&apos;'),
+    ('"', '&quot;'),
+    ('[', '&#91;'),
+    (']', '&#93;')
+]
+
+_sanitize = Replacer(CONTROL_CHAR_MAP)
+_escape = Replacer(PUNC_ENTITY_MAP)
+_unescape = Replacer([(entity, punc) for punc, entity in PUNC_ENTITY_MAP])
+
+
+def sanitize_text(text):
+    """Sanitize user input by normalizing control characters etc.
+
+    Parameters:
+        text (string): text to sanitize.
+
+    Returns:
+        Sanitized text.
+    """
+    return _sanitize(text)
+
+
+def escape_html_entities(text):
+    """Replace punctuation marks in text with HTML entities.
+
+    Parameters:
+        text (string): text to escape.
+
+    Returns:
+        string with punctuations escaped.
+    """
+    return _escape(text)
+
+
+def unescape_html_entities(text):
+    """Replace HTML entities with punctuation marks.
+    This is the inverse of escape_html_entities() above.
+
+    Parameters:
+        text (string): text to unescape.
+
+    Returns:
+        string with HTML entities unescaped.
+    """
+    return _unescape(text)
+
+
+def _replace_sequentially(pairs, text):
+    """The former implementation: one str.replace() pass per pair, for benchmarking."""
+    for old, new in pairs:
+        text = text.replace(old, new)
+    return text
+
+
+def benchmark(lines, repeat=5):
+    """Time the normalization functions against sequential replacement.
+
+    Each function gets the input it gets in translate(): sanitize_text() whole
+    lines, escape_html_entities() single tokens, and unescape_html_entities()
+    whole lines of escaped tokens, as output by Moses.
+
+    Parameters:
+        lines (list of strings): sample of (tokenized) text lines.
+
+    Returns:
+        list of (name, microseconds per call (one pass), microseconds per call (sequential)).
+    """
+    tokens = [token for line in lines for token in line.split()]
+    escaped = [' '.join(escape_html_entities(token) for token in line.split()) for line in lines]
+    unescape_map = [(entity, punc) for punc, entity in PUNC_ENTITY_MAP]
+    cases = [('sanitize_text', sanitize_text, CONTROL_CHAR_MAP, lines),
+             ('escape_html_entities', escape_html_entities, PUNC_ENTITY_MAP, tokens),
+             ('unescape_html_entities', unescape_html_entities, unescape_map, escaped)]
+    results = []
+    for name, function, pairs, texts in cases:
+        def one_pass():
+            for text in texts:
+                function(text)
+
+        def sequential():
+            for text in texts:
+                _replace_sequentially(pairs, text)
+
+        per_call = 1e6 / max(len(texts), 1)
+        results.append((name,
+                        min(timeit.repeat(one_pass, number=1, repeat=repeat)) * per_call,
+                        min(timeit.repeat(sequential, number=1, repeat=repeat)) * per_call))
+    return results
+
+
+def main():
+    f = open(sys.argv[1]) if len(sys.argv) > 1 else sys.stdin
+    lines = [line.decode('utf-8').rstrip('\n') for line in f]
+    print '%d lines' % len(lines)
+    for name, one_pass, sequential in benchmark(lines):
+        print '%-24s %6.2f us/call (sequential replace: %6.2f us/call)' % (
+            name, one_pass, sequential)
+
+
+if __name__ == '__main__':
+    main()
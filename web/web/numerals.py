@@ -0,0 +1,198 @@
+"""Rule-based translation of numbers between English and Lojban.
+
+Numbers are among the most common queries, and are translated
+deterministically here instead of being decoded by Moses (which also gets
+multi-digit numbers wrong):
+
+- English digits ("12", "1,000", "-3.5") and number words ("twelve",
+  "one hundred and five") become Lojban digit cmavo ("pa re", "pa no no no",
+  "ni'u ci pi mu", "pa no mu").
+- Lojban numerals ("pa re", "li pare", "pa ki'o") become digits ("12", "12", "1000").
+
+Both functions take the tokens of the whole input, as produced by
+tokenize_en() / tokenize_jb(), and return None unless the whole input is a number.
+"""
+import re
+
+DIGITS = ['no', 'pa', 're', 'ci', 'vo', 'mu', 'xa', 'ze', 'bi', 'so']
+DIGIT_VALUES = dict((cmavo, str(i)) for i, cmavo in enumerate(DIGITS))
+
+# Decimal point, sign and thousands separator cmavo.
+DECIMAL_POINT = 'pi'
+NEGATIVE = "ni'u"
+POSITIVE = "ma'u"
+THOUSANDS = "ki'o"
+
+# Number article, optionally preceding a Lojban number.
+NUMBER_ARTICLE = 'li'
+
+# Trailing punctuation tokens ignored in English input ("1.", "twelve!").
+FINAL_PUNCTUATION = ['.', '!', '?']
+
+# The optional final period is for "1.", which the tokenizer keeps as a list marker.
+_EN_NUMBER = re.compile(r'^([-+]?)(\d{1,3}(?:,\d{3})+|\d+)(?:\.(\d+))?\.?$')
+
+# Splits concatenated cmavo such as "pare" or "nipi'ure".
+_JB_NUMBER_WORD = re.compile("(no|pa|re|ci|vo|mu|xa|ze|bi|so|pi|ni'u|ma'u|ki'o)")
+
+EN_UNITS = ['zero', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine',
+            'ten', 'eleven', 'twelve', 'thirteen', 'fourteen', 'fifteen', 'sixteen',
+            'seventeen', 'eighteen', 'nineteen']
+EN_TENS = ['', '', 'twenty', 'thirty', 'forty', 'fifty', 'sixty', 'seventy', 'eighty', 'ninety']
+EN_SCALES = {'thousand': 10 ** 3, 'million': 10 ** 6, 'billion': 10 ** 9}
+
+EN_WORD_VALUES = dict((word, i) for i, word in enumerate(EN_UNITS))
+EN_WORD_VALUES.update((word, i * 10) for i, word in enumerate(EN_TENS) if word)
+
+
+def parse_en_words(words):
+    """Parse English number words (e.g., ["one", "hundred", "and", "five"]) into an int.
+
+    Returns:
+        the value, or None if the words do not form a number. Adjacent number
+        words only combine as tens followed by a unit ("twenty one"); a group
+        has at most one "hundred", right after a unit from one to nine; the
+        scales thousand, million and billion must decrease; and "and" must be
+        followed by a number word. So "one one", "ten five", "twenty hundred",
+        "one thousand two thousand" or "one and" are not numbers.
+    """
+    total, current = 0, 0
+    seen = False
+    # Whether the current group below one thousand has units (including teens),
+    # tens and hundreds, and the last scale word.
+    units, tens, hundreds = False, False, False
+    last_scale = None
+    for i, word in enumerate(words):
+        if word == 'and' and seen:
+            if i + 1 == len(words) or words[i + 1] not in EN_WORD_VALUES:
+                return None
+            continue
+        if word in EN_WORD_VALUES:
+            value = EN_WORD_VALUES[word]
+            if value < 20:
+                if units or (tens and value >= 10):
+                    return None
+                units = True
+            else:
+                if units or tens:
+                    return None
+                tens = True
+            current += value
+        elif word == 'hundred' and seen:
+            if hundreds or tens or not 1 <= current <= 9:
+                return None
+            units, hundreds = False, True
+            current *= 100
+        elif word in EN_SCALES and seen:
+            scale = EN_SCALES[word]
+            if current == 0 or (last_scale is not None and scale >= last_scale):
+                return None
+            total += current * scale
+            current = 0
+            units, tens, hundreds = False, False, False
+            last_scale = scale
+        else:
+            return None
+        seen = True
+    if not seen:
+        return None
+    return total + current
+
+
+def digits_to_jb(digits):
+    """Convert a string of digits, '.' and a leading '-' to Lojban digit cmavo."""
+    words = []
+    for ch in digits:
+        if ch == '-':
+            words.append(NEGATIVE)
+        elif ch == '.':
+            words.append(DECIMAL_POINT)
+        else:
+            words.append(DIGITS[int(ch)])
+    return ' '.join(words)
+
+
+def en_to_jb(tokens):
+    """Translate an English number to Lojban.
+
+    Parameters:
+        tokens (list of strings): tokenized English input.
+
+    Returns:
+        Lojban digit cmavo (string), or None if the input is not a number.
+    """
+    while tokens and tokens[-1] in FINAL_PUNCTUATION:
+        tokens = tokens[:-1]
+    # The tokenizer splits the sign off a number: "-3.5" => ["-", "3.5"]
+    if len(tokens) == 2 and tokens[0] in ['-', '+']:
+        tokens = [tokens[0] + tokens[1]]
+    if len(tokens) == 1:
+        m = _EN_NUMBER.match(tokens[0])
+        if m:
+            sign, integer, fraction = m.groups()
+            digits = ('-' if sign == '-' else '') + integer.replace(',', '')
+            if fraction:
+                digits += '.' + fraction
+            return digits_to_jb(digits)
+    words = []
+    for token in tokens:
+        words.extend(token.lower().split('-'))
+    negative = len(words) > 1 and words[0] in ['minus', 'negative']
+    value = parse_en_words(words[1:] if negative else words)
+    if value is None:
+        return None
+    return digits_to_jb(('-' if negative else '') + str(value))
+
+
+def jb_to_en(tokens):
+    """Translate a Lojban number to English digits.
+
+    Parameters:
+        tokens (list of strings): tokenized Lojban input.
+
+    Returns:
+        digits (string), or None if the input is not a number.
+    """
+    if tokens and tokens[0] == NUMBER_ARTICLE:
+        tokens = tokens[1:]
+    words = []
+    for token in tokens:
+        parts = _JB_NUMBER_WORD.split(token)
+        # Splitting on a capturing group leaves '' between and around the cmavo.
+        if any(parts[0::2]):
+            return None
+        words.extend(parts[1::2])
+    if not any(w in DIGIT_VALUES for w in words):
+        return None
+
+    sign = ''
+    if words[0] in [NEGATIVE, POSITIVE]:
+        sign = '-' if words[0] == NEGATIVE else ''
+        words = words[1:]
+    if DECIMAL_POINT in words:
+        point = words.index(DECIMAL_POINT)
+        words, fraction = words[:point], words[point + 1:]
+        if not fraction or any(w not in DIGIT_VALUES for w in fraction):
+            return None
+    else:
+        fraction = []
+
+    # Digits after each thousands separator form a group of three, padded with leading zeros.
+    groups = [[]]
+    for word in words:
+        if word == THOUSANDS:
+            groups.append([])
+        elif word in DIGIT_VALUES:
+            groups[-1].append(DIGIT_VALUES[word])
+        else:
+            return None
+    if any(len(group) > 3 for group in groups[1:]):
+        return None
+    integer = ''.join(groups[0]) + ''.join(''.join(group).rjust(3, '0') for group in groups[1:])
+    # "ki'o pa" or "no pa" would be written with leading zeros ("001", "01").
+    if len(groups) > 1 and not groups[0] or len(integer) > 1 and integer[0] == '0':
+        return None
+    result = sign + (integer or '0')
+    if fraction:
+        result += '.' + ''.join(DIGIT_VALUES[w] for w in fraction)
+    return result
@@ -0,0 +1,58 @@
+"""Ordered, memory-bounded processing of long streams in a pool of processes.
+
+Corpus preparation tokenizes and detokenizes files of millions of lines.
+The batch functions of the tokenizers and the detokenizer cut their input
+into chunks with iter_chunks() and fan the chunks out to a pool of processes
+with map_chunks(), which yields the results in the original order:
+
+    chunks = ((options, chunk) for chunk in iter_chunks(lines, 1000))
+    for results in map_chunks(_process_chunk, chunks, processes=4):
+        for result in results:
+            ...
+
+The function given to map_chunks() must be picklable, i.e. defined at the
+top level of a module.
+"""
+import collections
+import multiprocessing
+
+
+def iter_chunks(iterable, size=1000):
+    """Yield lists of (at most) size consecutive items of the iterable."""
+    chunk = []
+    for x in iterable:
+        chunk.append(x)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def map_chunks(function, chunks, processes=None):
+    """Yield function(chunk) for each chunk in the iterable, in order.
+
+    With processes > 1 (default: the number of CPUs), the chunks are processed
+    by a pool of processes. At most 2 chunks per process are read ahead, so
+    memory use is bounded however long the input is.
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if processes <= 1:
+        for chunk in chunks:
+            yield function(chunk)
+        return
+    pool = multiprocessing.Pool(processes)
+    try:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(function, (chunk,)))
+            if len(pending) >= 2 * processes:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+        pool.close()
+    finally:
+        # Also stops the workers if the caller stops iterating early.
+        pool.terminate()
+        pool.join()
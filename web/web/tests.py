@@ -15,3 +15,459 @@ class ViewTests(unittest.TestCase):
         request = testing.DummyRequest()
         info = my_view(request)
         self.assertEqual(info['project'], 'web')
+
+
+class JobStoreTests(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        from .jobs import JobStore
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = JobStore(self.tmpdir + '/jobs.sqlite', max_jobs_per_client=1)
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def test_submit_and_process(self):
+        from .jobs import JobWorker, DONE
+        job_id = self.store.submit('127.0.0.1', 'jb2en', u'coi\n\nco\'o')
+        worker = JobWorker(self.store, lambda src, direction: src.upper())
+        worker.process(self.store.claim())
+        job = self.store.get(job_id)
+        self.assertEqual(job['state'], DONE)
+        self.assertEqual(job['done'], 3)
+        self.assertEqual(job['tgt'], u'COI\n\nCO\'O')
+        self.assertEqual(self.store.claim(), None)
+
+    def test_failed_translation(self):
+        from .jobs import JobWorker, FAILED
+
+        def translate(src, direction):
+            if src == u'co\'o':
+                raise IOError('Moses server is down')
+            return src.upper()
+
+        job_id = self.store.submit('127.0.0.1', 'jb2en', u'coi\nco\'o\ncoi')
+        JobWorker(self.store, translate).process(self.store.claim())
+        job = self.store.get(job_id)
+        self.assertEqual(job['state'], FAILED)
+        self.assertEqual(job['done'], 1)
+        self.assertEqual(job['tgt'], None)
+
+    def test_translate_text(self):
+        import web
+
+        class BrokenMosesServer(object):
+            def translate_en2jb(self, text):
+                raise IOError('Moses server is down')
+
+        class EchoMosesServer(object):
+            def translate_en2jb(self, text):
+                return text
+
+        server = web.MOSES_SERVER
+        try:
+            web.MOSES_SERVER = BrokenMosesServer()
+            self.assertRaises(web.TranslationError, web.translate_text, u'Hello there', 'en2jb')
+            self.assertEqual(web.translate(u'Hello there', 'en2jb'), u'')
+            web.MOSES_SERVER = EchoMosesServer()
+            src = u' '.join([u'word'] * 100)
+            self.assertEqual(web.translate_text(src, 'en2jb'), src)
+            self.assertEqual(web.translate(src, 'en2jb'), src[:web.MAX_TEXT_LEN])
+        finally:
+            web.MOSES_SERVER = server
+
+    def test_submit_view_refuses_oversized_text(self):
+        import web
+        from pyramid.httpexceptions import HTTPRequestEntityTooLarge
+        from .jobs import MAX_JOB_TEXT_LEN
+        from .views import job_submit_view
+        store = web.JOB_STORE
+        web.JOB_STORE = self.store
+        try:
+            request = testing.DummyRequest(params={'src': u'coi\n' * (MAX_JOB_TEXT_LEN // 4 + 1),
+                                                   'dir': 'jb2en'})
+            self.assertRaises(HTTPRequestEntityTooLarge, job_submit_view, request)
+        finally:
+            web.JOB_STORE = store
+        conn = self.store._connect()
+        try:
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM jobs').fetchone()[0], 0)
+        finally:
+            conn.close()
+
+    def test_max_jobs_per_client(self):
+        from .jobs import TooManyJobs
+        self.store.submit('127.0.0.1', 'jb2en', u'coi')
+        self.assertRaises(TooManyJobs, self.store.submit, '127.0.0.1', 'jb2en', u'coi')
+        self.store.submit('127.0.0.2', 'jb2en', u'coi')
+
+
+class LexiconTests(unittest.TestCase):
+    def test_lookup(self):
+        import os
+        from .lexicon import Lexicon
+        lexicon = Lexicon(os.path.join(os.path.dirname(__file__), '..', '..',
+                                       'train.en-jb', 'model', 'best-translation.bin'))
+        self.assertEqual(lexicon.lookup(u'apple'), u'plise')
+        self.assertEqual(lexicon.lookup(u'cat'), u'mlatu')
+        self.assertEqual(lexicon.lookup(u'zzzz'), None)
+        self.assertEqual(lexicon.lookup(u''), None)
+
+
+class TranslationMemoryTests(unittest.TestCase):
+    def test_build_and_lookup(self):
+        import os
+        import shutil
+        import tempfile
+        from .translation_memory import TranslationMemory, build_memory, write_memory
+        pairs = [(u'coi  ', u'Hi!'), (u'coi', u'Hello!'), (u'coi', u'Hello!'), (u'', u'Empty.')]
+        entries = build_memory(pairs, lambda src: ' '.join(src.split()), lambda tgt: tgt)
+        self.assertEqual(entries, {u'coi': u'Hello!'})
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'tm.gz')
+            write_memory(entries, path)
+            memory = TranslationMemory(path)
+            self.assertEqual(memory.lookup(u'coi'), u'Hello!')
+            self.assertEqual(memory.lookup(u'coi do'), None)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_fuzzy_match(self):
+        from .translation_memory import FuzzyMatcher, TranslationMemory
+        memory = TranslationMemory.__new__(TranslationMemory)
+        memory.entries = {u'The car is ready .': u'le karce cu bredi',
+                          u'This is my car .': u'ti du le mi karce'}
+        matcher = FuzzyMatcher(memory)
+        score, src, tgt = matcher.lookup(u'The car is not ready .')
+        self.assertEqual((src, tgt), (u'The car is ready .', u'le karce cu bredi'))
+        self.assertAlmostEqual(score, 1 - 1.0 / 6)
+        self.assertEqual(matcher.lookup(u'Completely unrelated words here and there .'), None)
+
+    def test_fuzzy_match_unindexed_bigrams(self):
+        from .translation_memory import FuzzyMatcher, TranslationMemory
+
+        class SmallIndexMatcher(FuzzyMatcher):
+            MAX_POSTINGS = 1
+
+        memory = TranslationMemory.__new__(TranslationMemory)
+        memory.entries = {u'I am studying the history of art .': u'mi tadni lo citri be lo larcu',
+                          u'I like cats .': u'mi nelci lo mlatu'}
+        matcher = SmallIndexMatcher(memory)
+        # (<s>, I) and (., </s>) occur in both sentences, so they are not indexed.
+        self.assertFalse((u'<s>', u'I') in matcher.index)
+        score, src, _ = matcher.lookup(u'I zzz1 studying zzz3 history zzz5 art .')
+        self.assertEqual(src, u'I am studying the history of art .')
+        self.assertAlmostEqual(score, 1 - 3.0 / 8)
+
+    def test_translate_with_match(self):
+        import web
+        from .translation_memory import FuzzyMatcher, TranslationMemory
+
+        class EchoMosesServer(object):
+            calls = 0
+
+            def translate_en2jb(self, text):
+                self.calls += 1
+                return text
+
+        memory = TranslationMemory.__new__(TranslationMemory)
+        memory.entries = {u'a quick cat': u'lo sutra mlatu'}
+        saved = web.MOSES_SERVER, web.TRANSLATION_MEMORIES, web.FUZZY_MATCHERS
+        web.MOSES_SERVER = EchoMosesServer()
+        web.TRANSLATION_MEMORIES = {'en2jb': memory}
+        web.FUZZY_MATCHERS = {'en2jb': FuzzyMatcher(memory)}
+        try:
+            tgt, match = web.translate_with_match(u'a quick dog', 'en2jb')
+            self.assertEqual((tgt, match[1]), (u'a quick dog', u'a quick cat'))
+            # Matches below FUZZY_MATCH_MIN_SCORE are not shown.
+            self.assertEqual(web.translate_with_match(u'a', 'en2jb'), (u'a', None))
+            # No fuzzy match after an exact or numeral hit.
+            self.assertEqual(web.translate_with_match(u'a quick cat', 'en2jb'),
+                             (u'lo sutra mlatu', None))
+            self.assertEqual(web.translate_with_match(u'twelve', 'en2jb'), (u'pa re', None))
+            self.assertEqual(web.MOSES_SERVER.calls, 2)
+        finally:
+            web.MOSES_SERVER, web.TRANSLATION_MEMORIES, web.FUZZY_MATCHERS = saved
+
+    def test_bounded_edit_distance(self):
+        from .translation_memory import bounded_edit_distance
+        self.assertEqual(bounded_edit_distance(list('kitten'), list('sitting'), 3), 3)
+        self.assertEqual(bounded_edit_distance(list('kitten'), list('sitting'), 2), None)
+        self.assertEqual(bounded_edit_distance([], ['a'], 1), 1)
+
+
+class NumeralTests(unittest.TestCase):
+    def test_en_to_jb(self):
+        from .numerals import en_to_jb
+        self.assertEqual(en_to_jb([u'1']), u'pa')
+        self.assertEqual(en_to_jb([u'1,024', u'.']), u'pa no re vo')
+        self.assertEqual(en_to_jb([u'-', u'3.5']), u"ni'u ci pi mu")
+        self.assertEqual(en_to_jb([u'One', u'hundred', u'and', u'twenty-one']), u'pa re pa')
+        self.assertEqual(en_to_jb([u'I', u'have', u'2', u'cats']), None)
+        self.assertEqual(en_to_jb([u'twenty', u'one']), u're pa')
+        self.assertEqual(en_to_jb([u'one', u'thousand', u'two']), u'pa no no re')
+        # Adjacent units, teens and tens do not add up; Moses translates these.
+        for tokens in [[u'one', u'one'], [u'one-two'], [u'ten', u'five'], [u'one', u'and', u'one'],
+                       [u'zero', u'one'], [u'twenty', u'eleven'], [u'twenty', u'one', u'two'],
+                       [u'ten', u'twenty'], [u'one', u'hundred', u'five', u'twenty']]:
+            self.assertEqual(en_to_jb(tokens), None)
+        self.assertEqual(en_to_jb([u'two', u'million', u'three', u'thousand', u'and', u'five']),
+                         u're no no ci no no mu')
+        # Repeated or increasing scales and dangling conjunctions are not numbers either.
+        for words in [u'one hundred two hundred', u'one thousand two thousand',
+                      u'one hundred hundred', u'twenty hundred', u'one million billion',
+                      u'one and', u'one thousand and']:
+            self.assertEqual(en_to_jb(words.split()), None)
+
+    def test_jb_to_en(self):
+        from .numerals import jb_to_en
+        self.assertEqual(jb_to_en([u'pa', u're', u'ci']), u'123')
+        self.assertEqual(jb_to_en([u'li', u'pare']), u'12')
+        self.assertEqual(jb_to_en([u'pa', u"ki'o", u're']), u'1002')
+        self.assertEqual(jb_to_en([u"ni'u", u'no', u'pi', u'mu']), u'-0.5')
+        self.assertEqual(jb_to_en([u'coi']), None)
+        self.assertEqual(jb_to_en([u'pa', u'mlatu']), None)
+        # Leading zeros: Moses translates these.
+        self.assertEqual(jb_to_en([u"ki'o", u'pa']), None)
+        self.assertEqual(jb_to_en([u'no', u'pa']), None)
+        self.assertEqual(jb_to_en([u'no']), u'0')
+
+
+class TokenizerTests(unittest.TestCase):
+    def english_corpus(self):
+        import glob
+        import os
+        from .translation_memory import iterate_bitext
+        docs_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'docs')
+        for filename in sorted(glob.glob(os.path.join(docs_dir, '*.xml'))):
+            for _, eng_t in iterate_bitext(filename):
+                # ElementTree returns plain strings for ASCII-only text.
+                yield unicode(eng_t)
+
+    def test_split_lines_matches_split_words_pipeline(self):
+        import random
+        import re
+        from .tokenize_en import split_words, split_lists, split_hyphenation, split_lines, \
+            normalize_unicode, test1, test2, WHITESPACE
+
+        def original_split_words(string, keep="\n"):
+            # split_words() before its patterns were precompiled.
+            w = "|".join(filter(lambda ch: ch not in keep, WHITESPACE))
+            for ch in keep:
+                string = re.sub(ch+"["+ch+"|\s]+", ch, string)
+                string = re.sub("\s{0,1}\n\s{0,1}", " "+ch+" ", string)
+            string = string.strip()
+            string = re.compile(w).sub(" ", string)
+            string = re.sub(" +", " ", string)
+            return string.split(" ")
+
+        rng = random.Random(0)
+        fuzzed = [u''.join(rng.choice([u'a', u'b.', u'-', u'1.', u'*', u' ', u'\t', u'\n', u'\r',
+                                       u'\f', u'\v'])
+                           for _ in range(rng.randint(0, 15)))
+                  for _ in range(5000)]
+        count = 0
+        corpus = list(self.english_corpus())
+        # Lines read from files end with a newline.
+        for string in corpus + [line + u'\n' for line in corpus] + [test1, test2] + fuzzed:
+            string = normalize_unicode(string)
+            self.assertEqual(split_words(string), original_split_words(string))
+            expected = split_hyphenation(split_lists(original_split_words(string, keep="\n")))
+            expected = [word for word in expected if word != "\n"]
+            self.assertEqual(split_lines(string), expected)
+            count += 1
+        self.assertTrue(count > 25000)
+
+    def test_token_cache(self):
+        from .tokenize_en import TokenCache
+        cache = TokenCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)  # evicts 'b', the least recently used token
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(len(cache), 2)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+
+    def test_split_word_cache(self):
+        from .tokenize_en import split_word, _split_word, split_word_cache
+        for word in [u"Mr.", u"don't", u"10km.", u"wait;go", u"(hello)", u"10:45."]:
+            self.assertEqual(split_word(word), _split_word(word))
+            hits = split_word_cache.hits
+            result = split_word(word)
+            self.assertEqual(result, _split_word(word))
+            self.assertEqual(split_word_cache.hits, hits + 1)
+            # Callers may modify the returned list.
+            result.append(u"x")
+            self.assertEqual(split_word(word), _split_word(word))
+
+    def test_range_matcher(self):
+        from .tokenize_en import known_ranges, which_range, abbreviations, numeric, URI, entities
+        words = [u"Mr.", u"U.S.", u"T.", u"Mr", u"10km", u"10:45", u"10xyz", u"www.example",
+                 u"nodebox.net/Home", u"tom@example.com", u"&eacute;", u"&#164;", u"&;",
+                 u"hello", u"Mr.\n", u""]
+        ranges = list(known_ranges)
+        for word in words + [w for s in self.english_corpus() for w in s.split()]:
+            self.assertTrue(which_range(word, known_ranges) is which_range(word, ranges))
+        self.assertTrue(which_range(u"Mr.", known_ranges) is abbreviations)
+        self.assertTrue(which_range(u"10km", known_ranges) is numeric)
+        self.assertTrue(which_range(u"www.example", known_ranges) is URI)
+        self.assertTrue(which_range(u"&eacute;", known_ranges) is entities)
+
+    def test_prohibited_sentence_break(self):
+        from .tokenize_en import prohibited_sentence_break
+        words = "Shown before ( Adams , A. E. 1991. Nature (Lond.). 354:404-408. ) . Next".split()
+        self.assertEqual(prohibited_sentence_break(words), set(range(3, 12)))
+        # A match ending with the last word.
+        self.assertEqual(prohibited_sentence_break(words[:12]), set(range(3, 12)))
+
+    def test_split_spans(self):
+        from .tokenize_en import split, split2, split_spans, test1, test2
+        for string in [test1, test2, u"Wait\u2026 \xabyes\xbb he said. Cannot go!"]:
+            for sentences, splitter in [(True, split), (False, split2)]:
+                spans = split_spans(string, sentences)
+                self.assertEqual([u" ".join(token for token, _, _ in tokens) for _, _, tokens in spans],
+                                 splitter(string))
+        string = u"Wait\u2026 \xabyes\xbb he said. Cannot go!"
+        spans = split_spans(string)
+        self.assertEqual([string[start:stop] for start, stop, _ in spans],
+                         [u"Wait\u2026 \xabyes\xbb he said.", u"Cannot go!"])
+        self.assertEqual([(token, string[start:stop]) for token, start, stop in spans[0][2][:3]],
+                         [(u"Wait", u"Wait"), (u"...", u"\u2026"), (u"<<", u"\xab")])
+        self.assertEqual([string[start:stop] for _, start, stop in spans[1][2][:2]], [u"Can", u"not"])
+
+    def test_check_policy(self):
+        from .tokenize_en import split2, verify, set_check_policy, check_counts, \
+            CHECK_ALWAYS, CHECK_SAMPLED, CHECK_NEVER
+        counts = dict(check_counts)
+        try:
+            set_check_policy(CHECK_NEVER)
+            split2(u"Hello world.")
+            set_check_policy(CHECK_SAMPLED, 1.0)
+            split2(u"Hello world.")
+            self.assertRaises(ValueError, verify, u"Hello world.", [u"Hello word ."])
+            self.assertRaises(ValueError, set_check_policy, 'sometimes')
+        finally:
+            set_check_policy(CHECK_ALWAYS, 0.01)
+        self.assertEqual(check_counts['skipped'], counts['skipped'] + 1)
+        self.assertEqual(check_counts['checked'], counts['checked'] + 2)
+        self.assertEqual(check_counts['mismatches'], counts['mismatches'] + 1)
+
+    def test_verify_batch_line_boundaries(self):
+        from .tokenize_en import verify_batch, set_check_policy, CHECK_ALWAYS
+        set_check_policy(CHECK_ALWAYS)
+        self.assertTrue(verify_batch([u'Hi there.', u'Bye.'], [[u'Hi there .'], [u'Bye .']]))
+        # The same characters overall, but "." moved to the output of the next line.
+        self.assertRaises(ValueError, verify_batch, [u'Hi there.', u'Bye'],
+                          [[u'Hi there'], [u'. Bye']])
+
+    def test_split_stream(self):
+        from .tokenize_en import split, split2, split_stream, test1, test2
+        lines = [line for line in (test1 + test2).split(u"\n") if line.strip()] * 5
+        self.assertEqual(list(split_stream(iter(lines), split2, processes=2, chunksize=3)),
+                         [split2(line) for line in lines])
+        self.assertEqual(list(split_stream(lines, split, processes=1)), [split(line) for line in lines])
+
+    def test_split2_batch(self):
+        from .tokenize_en import split2, split2_batch, test1, test2
+        lines = [line for line in (test1 + test2).split(u"\n")] + [test1, u"", u"<b>Hi</b>"]
+        expected = [u" ".join(split2(line)).split(u" ") for line in lines]
+        self.assertEqual(list(split2_batch(iter(lines), chunksize=4)), expected)
+        self.assertEqual(list(split2_batch(lines, processes=2, chunksize=4)), expected)
+        self.assertEqual(list(split2_batch([u"<b>Hi</b>"], tags=False)), [[u"Hi"]])
+
+
+class DetokenizerTests(unittest.TestCase):
+    def test_detokenize(self):
+        from .detokenize import Detokenizer
+        detokenizer = Detokenizer({'moses_deescape': True})
+        for _ in range(2):  # the second time from the token class cache
+            self.assertEqual(detokenizer.detokenize(u'I \' m here , " he said " ( really ) .'),
+                             u'I\'m here, "he said" (really).')
+            self.assertEqual(detokenizer.detokenize(u'Jones \' car costs $ 5 &amp; more'),
+                             u'Jones\' car costs $5 & more')
+
+    def test_detokenize_batch(self):
+        from .detokenize import Detokenizer
+        detokenizer = Detokenizer({'moses_deescape': True})
+        texts = [u'Hello , world !', u'a &amp; b', u'" Yes , " he said .'] * 5
+        expected = [detokenizer.detokenize(text) for text in texts]
+        self.assertEqual(list(detokenizer.detokenize_batch(iter(texts))), expected)
+        self.assertEqual(list(detokenizer.detokenize_batch(texts, processes=2, chunksize=4)), expected)
+
+    def test_incremental_detokenizer(self):
+        from .detokenize import Detokenizer, IncrementalDetokenizer
+        detokenizer = Detokenizer({'moses_deescape': True})
+        incremental = IncrementalDetokenizer(detokenizer)
+        text = u'" Hello , " Jones \' car &amp ; I \' m here .'
+        parts = [incremental.add(token) for token in text.split(u' ')]
+        self.assertEqual(parts[:3], [u'"', u'Hello', u','])
+        self.assertEqual(parts[5], u'')  # the apostrophe waits for the next token
+        self.assertEqual(u''.join(parts) + incremental.flush(), detokenizer.detokenize(text))
+        # flush() starts a new text
+        self.assertEqual(incremental.add(u'(') + incremental.add(u'a') + incremental.flush(), u'(a')
+
+
+class NormalizeTests(unittest.TestCase):
+    def test_sanitize_text(self):
+        from .normalize import sanitize_text
+        self.assertEqual(sanitize_text(u'a\tb\r\nc\x07\x1B'), u'a b c')
+        self.assertEqual(sanitize_text(u'plain'), u'plain')
+
+    def test_escape_html_entities(self):
+        from .normalize import escape_html_entities, unescape_html_entities
+        self.assertEqual(escape_html_entities(u'[a|b] & "c"'),
+                         u'&#91;a&#124;b&#93; &amp; &quot;c&quot;')
+        for text in [u'<&>', u"'&lt;'", u'&amp;#124;', u'no entities']:
+            self.assertEqual(unescape_html_entities(escape_html_entities(text)), text)
+        # each entity is unescaped once, "&amp;lt;" is the escaped form of "&lt;"
+        self.assertEqual(unescape_html_entities(u'&amp;lt; &lt;'), u'&lt; <')
+
+    def test_replacer(self):
+        from .normalize import Replacer
+        replace = Replacer([('a', 'b'), ('b', 'a'), ('ab', 'c')])
+        self.assertEqual(replace('aabba'), 'bcab')
+        self.assertEqual(replace('xyz'), 'xyz')
+
+
+class LojbanTokenizerTests(unittest.TestCase):
+    def test_tokenize(self):
+        from .tokenize_jb import tokenize
+        # web.tokenize_jb(): brackets are split off
+        self.assertEqual(tokenize(u'i mi [klama] .i  do'), [u'mi', u'[', u'klama', u']', u'i', u'do'])
+        self.assertEqual(tokenize(u' coi. '), [u'', u'coi', u''])
+        self.assertEqual(tokenize(u''), [u''])
+        # scripts/tokenize_jbo.py: brackets are kept
+        self.assertEqual(tokenize(u'i mi [klama] .i  do', brackets=False),
+                         [u'mi', u'[klama]', u'i', u'do'])
+
+    def test_tokenize_matches_old_implementations(self):
+        import random
+        import re
+        from .tokenize_jb import tokenize
+
+        def web_tokenize(text):
+            text = text.replace('[', ' [ ').replace(']', ' ] ')
+            tokens = [word.strip('.?') for word in re.split(' +', text)]
+            return tokens[1:] if tokens and tokens[0] == 'i' else tokens
+
+        def script_tokenize(text):
+            tokens = [word.strip('.?') for word in re.split(' +', text)]
+            return tokens[1:] if tokens and tokens[0] == 'i' else tokens
+
+        rng = random.Random(0)
+        for _ in range(2000):
+            text = u''.join(rng.choice(u'  .?[]ia\u00e0') for _ in range(rng.randint(0, 12)))
+            self.assertEqual(tokenize(text), web_tokenize(text))
+            self.assertEqual(tokenize(text, brackets=False), script_tokenize(text))
+
+    def test_tokenize_batch(self):
+        from .tokenize_jb import tokenize, tokenize_batch
+        texts = [u'i coi', u'[do]', u'', u'mi klama.'] * 3
+        expected = [tokenize(text) for text in texts]
+        self.assertEqual(list(tokenize_batch(texts)), expected)
+        self.assertEqual(list(tokenize_batch(texts, processes=2, chunksize=5)), expected)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+"""Lojban tokenizer, shared by the web server and corpus preparation.
+
+Lojban words are separated by spaces, so a text is tokenized by splitting it
+at runs of spaces and stripping periods and question marks off every word;
+a leading sentence separator 'i' is dropped. The web server also splits off
+brackets '[]', which crash Moses when passed as they are (web.tokenize_jb());
+corpus preparation (scripts/tokenize_jbo.py) does not.
+
+Library usage:
+
+    import tokenize_jb
+    tokens = tokenize_jb.tokenize(u'coi .i mi klama')  # [u'coi', u'i', u'mi', u'klama']
+    for tokens in tokenize_jb.tokenize_batch(lines, processes=4):  # in order
+        ...
+
+Command-line usage:
+
+    python tokenize_jb.py [-b] [-j PROCESSES] [input-file [output-file]]
+
+    -b = split off brackets '[]' as the web server does
+    -j = number of tokenizer processes (default: 1)
+
+    Reads STDIN and writes STDOUT if no files are given; prints the tokens of
+    every input line, separated by single spaces.
+"""
+import getopt
+import sys
+import time
+
+from parallel import iter_chunks, map_chunks
+
+
+def tokenize(text, brackets=True):
+    """Tokenize a Lojban text to a list of words.
+
+    This is the same as re.split(' +', text) followed by stripping periods and
+    question marks off each word (including the empty words before leading and
+    after trailing spaces), but splits with str.split() and skips the bracket
+    replacement for the texts without brackets.
+
+    Parameters:
+        text (string): Lojban text (unicode or UTF-8 bytes).
+        brackets (bool): surround brackets '[]' with spaces before splitting.
+
+    Returns:
+        list of words (strings)
+    """
+    if brackets and ('[' in text or ']' in text):
+        text = text.replace('[', ' [ ').replace(']', ' ] ')
+    tokens = [word.strip('.?') for word in text.split(' ') if word]
+    if not text or text[0] == ' ':
+        tokens.insert(0, text[:0])
+    if text and text[-1] == ' ':
+        tokens.append(text[:0])
+
+    # remove the first 'i'
+    if tokens and tokens[0] == 'i':
+        del tokens[0]
+    return tokens
+
+
+def _tokenize_chunk(args):
+    texts, brackets = args
+    return [tokenize(text, brackets) for text in texts]
+
+
+def tokenize_batch(texts, brackets=True, processes=1, chunksize=1000):
+    """Tokenize Lojban texts in a batch, see tokenize().
+
+    Parameters:
+        texts (iterable of strings): texts to tokenize.
+        brackets (bool): surround brackets '[]' with spaces before splitting.
+        processes (int): with processes > 1 (None: the number of CPUs), chunks
+            of chunksize texts are tokenized by a pool of processes, see
+            parallel.map_chunks().
+
+    Returns:
+        generator of lists of words, one per text, in order.
+    """
+    if processes is not None and processes <= 1:
+        for text in texts:
+            yield tokenize(text, brackets)
+        return
+    chunks = ((chunk, brackets) for chunk in iter_chunks(texts, chunksize))
+    for results in map_chunks(_tokenize_chunk, chunks, processes):
+        for tokens in results:
+            yield tokens
+
+
+def main(argv=None, brackets=False):
+    """Command-line interface, see the module docstring.
+
+    Args:
+        argv: command-line arguments (default: sys.argv[1:]).
+        brackets: split off brackets even without -b.
+    """
+    try:
+        opts, args = getopt.getopt(sys.argv[1:] if argv is None else argv, 'bj:h', ['help'])
+    except getopt.GetoptError as e:
+        print >>sys.stderr, e
+        print >>sys.stderr, __doc__
+        sys.exit(2)
+    processes = 1
+    for opt, arg in opts:
+        if opt == '-b':
+            brackets = True
+        elif opt == '-j':
+            processes = int(arg)
+        else:
+            print __doc__
+            sys.exit()
+    if len(args) > 2:
+        print >>sys.stderr, __doc__
+        sys.exit(2)
+
+    fh_in = open(args[0], 'rb') if len(args) > 0 else sys.stdin
+    fh_out = open(args[1], 'wb') if len(args) > 1 else sys.stdout
+    # UTF-8 bytes are tokenized as they are: only ASCII characters are special.
+    lines = (line.rstrip() for line in fh_in)
+    n, t = 0, time.time()
+    for tokens in tokenize_batch(lines, brackets, processes):
+        fh_out.write(' '.join(tokens) + '\n')
+        n += 1
+    fh_out.flush()
+    t = time.time() - t
+    print >>sys.stderr, '%d lines in %.1fs (%.0f lines/s)' % (n, t, n / max(t, 1e-6))
+
+
+if __name__ == '__main__':
+    main()
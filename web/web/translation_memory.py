@@ -0,0 +1,237 @@
+"""Exact- and fuzzy-match translation memory.
+
+Many inputs are verbatim sentences from the bitext corpora (Tatoeba,
+phrasebook, ...) whose human translations we already have. The translation
+memory maps the normalized form of every source sentence in the corpora to
+its reference translation, so that translate() can answer an exact hit with
+a single dict lookup instead of decoding it with Moses.
+
+FuzzyMatcher finds, for inputs without an exact hit, the memory sentence
+with the smallest token edit distance. Candidates are retrieved from an
+inverted index of token bigrams and only the most promising ones are scored
+with a bounded edit distance, so a lookup stays within a few milliseconds
+for memories of 100k+ sentences.
+
+Source sentences are normalized exactly as translate() normalizes its input
+(sanitize_text() followed by tokenize_jb() or tokenize_en()), so a hit only
+depends on the tokens Moses would have seen.
+
+The memory is built offline from the Solr XML files in docs/ and stored as
+a gzipped, tab-separated file of (normalized source, translation) lines:
+
+    python -m web.translation_memory --jb2en tm/exact.jb2en.gz \\
+        --en2jb tm/exact.en2jb.gz docs/tatoeba.xml docs/phrasebook.xml ...
+"""
+import argparse
+import collections
+import gzip
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+
+class TranslationMemory(object):
+    """In-memory exact-match translation memory loaded from a file written by write_memory()."""
+
+    def __init__(self, path):
+        self.entries = {}
+        with gzip.open(path, 'rb') as f:
+            for line in f:
+                key, tgt = line.decode('utf-8').rstrip('\n').split('\t')
+                self.entries[key] = tgt
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, key):
+        """Return the reference translation of the normalized source key, or None."""
+        return self.entries.get(key)
+
+
+class FuzzyMatcher(object):
+    """Fuzzy-match lookup over the sentences of a TranslationMemory."""
+
+    # Maximum token edit distance of a match.
+    MAX_EDITS = 3
+
+    # Maximum number of candidates scored with the edit distance.
+    MAX_CANDIDATES = 20
+
+    # Bigrams occurring in more sentences than this are not indexed;
+    # they carry little information and would dominate lookup time.
+    MAX_POSTINGS = 2000
+
+    def __init__(self, memory):
+        self.sentences = []
+        self.translations = []
+        postings = collections.defaultdict(list)
+        for key, tgt in memory.entries.items():
+            tokens = key.split(' ')
+            sent_id = len(self.sentences)
+            self.sentences.append(tokens)
+            self.translations.append(tgt)
+            for gram in set(_bigrams(tokens)):
+                postings[gram].append(sent_id)
+        self.index = dict((gram, ids) for gram, ids in postings.items()
+                          if len(ids) <= self.MAX_POSTINGS)
+
+    def lookup(self, key):
+        """Find the memory sentence closest to the normalized source key.
+
+        Returns:
+            a tuple (score, source, translation) where score is
+            1 - (token edit distance) / (length of the longer sentence),
+            or None if no sentence is within MAX_EDITS edits.
+        """
+        tokens = key.split(' ')
+        # Bigrams that are not indexed (too frequent) cannot be shared with any candidate.
+        grams = set(gram for gram in _bigrams(tokens) if gram in self.index)
+        # Each token edit destroys at most two bigrams.
+        min_shared = len(grams) - 2 * self.MAX_EDITS
+        shared = collections.defaultdict(int)
+        for gram in grams:
+            for sent_id in self.index[gram]:
+                shared[sent_id] += 1
+        candidates = [(count, sent_id) for sent_id, count in shared.items()
+                      if count >= min_shared
+                      and abs(len(self.sentences[sent_id]) - len(tokens)) <= self.MAX_EDITS]
+        candidates.sort(reverse=True)
+
+        best = None
+        max_edits = self.MAX_EDITS
+        for _, sent_id in candidates[:self.MAX_CANDIDATES]:
+            sentence = self.sentences[sent_id]
+            dist = bounded_edit_distance(tokens, sentence, max_edits)
+            if dist is None:
+                continue
+            score = 1.0 - float(dist) / max(len(tokens), len(sentence))
+            if best is None or score > best[0]:
+                best = (score, ' '.join(sentence), self.translations[sent_id])
+                max_edits = dist
+        return best
+
+
+def _bigrams(tokens):
+    """Return the token bigrams of a sentence, including sentence boundaries."""
+    padded = ['<s>'] + tokens + ['</s>']
+    return zip(padded, padded[1:])
+
+
+def bounded_edit_distance(a, b, max_dist):
+    """Compute the Levenshtein distance between two token lists if it is at most max_dist.
+
+    Only the diagonal band of width 2 * max_dist + 1 of the DP table is filled,
+    and the computation stops as soon as every cell of a row exceeds max_dist.
+
+    Returns:
+        the edit distance, or None if it is greater than max_dist.
+    """
+    if abs(len(a) - len(b)) > max_dist:
+        return None
+    inf = max_dist + 1
+    prev = [j if j <= max_dist else inf for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        cur = [inf] * (len(b) + 1)
+        if i <= max_dist:
+            cur[0] = i
+        lo, hi = max(1, i - max_dist), min(len(b), i + max_dist)
+        for j in range(lo, hi + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost, inf)
+        if min(cur) > max_dist:
+            return None
+        prev = cur
+    return prev[len(b)] if prev[len(b)] <= max_dist else None
+
+
+def iterparse_docs(source):
+    """Yield the 'doc' nodes of a Solr XML file without building its whole tree.
+
+    The file is parsed incrementally, and each node is removed from the tree
+    once the caller has moved on to the next one, so memory use is bounded by
+    the largest document, not by the file size. Also used by
+    scripts/convert_solr_xml_to_bitext.py.
+
+    Args:
+        source: XML filename or file object.
+    """
+    context = ET.iterparse(source, events=('start', 'end'))
+    _, root = next(context)
+    for event, node in context:
+        if event == 'end' and node.tag == 'doc':
+            yield node
+            root.clear()
+
+
+def iterate_bitext(filename):
+    """Yield (jbo_t, eng_t) tuples from a Solr XML file, skipping incomplete documents.
+
+    The file is parsed incrementally, see iterparse_docs().
+    """
+    for doc_node in iterparse_docs(filename):
+        fields = dict((field_node.attrib['name'], field_node.text) for field_node in doc_node)
+        if fields.get('jbo_t') and fields.get('eng_t'):
+            yield fields['jbo_t'], fields['eng_t']
+
+
+def build_memory(pairs, normalize, clean):
+    """Build a translation memory from (source, target) pairs.
+
+    Args:
+        pairs: iterable of (source, target) text pairs.
+        normalize: function mapping a source text to its lookup key.
+        clean: function applied to a target text before it is stored.
+
+    Returns:
+        a dict mapping each non-empty key to its most frequent translation
+        (the earliest one among equally frequent translations).
+    """
+    counts = collections.defaultdict(collections.Counter)
+    first_seen = {}
+    for i, (src, tgt) in enumerate(pairs):
+        if not src.strip():
+            continue
+        key = normalize(src)
+        tgt = clean(tgt).strip()
+        if not key or not tgt:
+            continue
+        counts[key][tgt] += 1
+        first_seen.setdefault((key, tgt), i)
+    return dict((key, min(c, key=lambda t: (-c[t], first_seen[(key, t)])))
+                for key, c in counts.items())
+
+
+def write_memory(entries, path):
+    """Write a translation memory built by build_memory() to path."""
+    with gzip.open(path, 'wb') as f:
+        for key in sorted(entries):
+            f.write((u'%s\t%s\n' % (key, entries[key])).encode('utf-8'))
+
+
+def main():
+    from web import sanitize_text, tokenize_en, tokenize_jb
+
+    parser = argparse.ArgumentParser(description='Build exact-match translation memories.')
+    parser.add_argument('xml_files', nargs='+', help='Solr XML files with jbo_t and eng_t fields')
+    parser.add_argument('--jb2en', help='Lojban to English memory file to write')
+    parser.add_argument('--en2jb', help='English to Lojban memory file to write')
+    args = parser.parse_args()
+
+    pairs = [pair for filename in args.xml_files for pair in iterate_bitext(filename)]
+    if args.jb2en:
+        entries = build_memory(pairs,
+                               lambda src: ' '.join(tokenize_jb(sanitize_text(src))),
+                               sanitize_text)
+        write_memory(entries, args.jb2en)
+        print '%d entries written to %s' % (len(entries), args.jb2en)
+    if args.en2jb:
+        entries = build_memory([(en, jb) for jb, en in pairs],
+                               lambda src: ' '.join(tokenize_en(sanitize_text(src))),
+                               sanitize_text)
+        write_memory(entries, args.en2jb)
+        print '%d entries written to %s' % (len(entries), args.en2jb)
+
+
+if __name__ == '__main__':
+    main()
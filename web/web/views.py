@@ -1,5 +1,10 @@
+from pyramid.httpexceptions import HTTPBadRequest, HTTPConflict, HTTPNotFound, \
+    HTTPRequestEntityTooLarge, HTTPTooManyRequests
+from pyramid.response import Response
 from pyramid.view import view_config
-from web import translate
+import web
+from web import translate_with_match
+import jobs
 
 
 @view_config(route_name='home', renderer='templates/home.pt')
@@ -10,11 +15,61 @@ def home_view(request):
         # Home page
         return {'dir': '',
                 'src': '',
-                'tgt': ''}
+                'tgt': '',
+                'match': None}
     else:
-        # Translate
-        tgt = translate(request.params['src'], request.params['dir'])
+        # Translate, along with the closest human translated sentence shown next to the output.
+        tgt, match = translate_with_match(request.params['src'], request.params['dir'])
 
         return {'dir': request.params['dir'],
                 'src': request.params['src'],
-                'tgt': tgt}
+                'tgt': tgt,
+                'match': match}
+
+
+def _get_job(request):
+    """Look up the job named in the URL, raising HTTPNotFound if there is none."""
+    job = web.JOB_STORE.get(request.matchdict['id']) if web.JOB_STORE else None
+    if job is None:
+        raise HTTPNotFound()
+    return job
+
+
+@view_config(route_name='job_submit', renderer='json')
+def job_submit_view(request):
+    """Submit an asynchronous translation job. Returns the job id to poll."""
+    if web.JOB_STORE is None:
+        raise HTTPNotFound()
+    if not ('src' in request.params and 'dir' in request.params
+            and request.params['dir'] in ['jb2en', 'en2jb']
+            and len(request.params['src']) > 0):
+        raise HTTPBadRequest()
+    if len(request.params['src']) > jobs.MAX_JOB_TEXT_LEN:
+        raise HTTPRequestEntityTooLarge()
+    try:
+        job_id = web.JOB_STORE.submit(request.client_addr, request.params['dir'],
+                                      request.params['src'])
+    except jobs.TooManyJobs:
+        raise HTTPTooManyRequests()
+    request.response.status_int = 202
+    return {'id': job_id,
+            'state': jobs.QUEUED}
+
+
+@view_config(route_name='job_status', renderer='json')
+def job_status_view(request):
+    """Poll the state and progress (translated / total lines) of a job."""
+    job = _get_job(request)
+    return {'id': job['id'],
+            'state': job['state'],
+            'done': job['done'],
+            'total': job['total']}
+
+
+@view_config(route_name='job_result')
+def job_result_view(request):
+    """Fetch the translated text of a finished job."""
+    job = _get_job(request)
+    if job['state'] != jobs.DONE:
+        raise HTTPConflict()
+    return Response(job['tgt'], content_type='text/plain', charset='utf-8')